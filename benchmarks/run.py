@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_upstream import FakeUpstream, generate_payloads, load_payloads
+
+# Usage: python -m benchmarks.run [--users 1000 --transactions 50000 --alerts 10000 ...] [--output results.json]
+# Runs the bot's hot paths against a SQLite database and local stand-ins for Binance and Yahoo, and writes the
+# timings as JSON so runs can be compared between releases.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the bot against local fakes of its upstreams.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--alerts', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--stocks', type=int, default=200, help='distinct stock tickers in generated payloads')
+    parser.add_argument('--cryptos', type=int, default=50, help='distinct crypto assets in generated payloads')
+    parser.add_argument('--payloads', help='directory with recorded get-products.json and quote.json to replay')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake upstreams wait per request')
+    parser.add_argument('--repeat', type=int, default=20, help='samples per benchmark')
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results here instead of stdout')
+    return parser.parse_args()
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {'samples': len(samples),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+            'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3)}
+
+
+async def measure(repeat, fn, *args):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        await fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+# Bulk-loads users, a ledger of buys spread over the payload's assets, alerts and limit orders, then rebuilds
+# the holding table from the ledger the same way a migration would.
+def seed(database_connector, args, stock_prices, crypto_prices, rng):
+    session = database_connector.session
+    assets = [(code, 0, price) for code, price in stock_prices.items()] + \
+             [(code, 1, price) for code, price in crypto_prices.items()]
+    user_ids = [str(10 ** 16 + i) for i in range(args.users)]
+    start = datetime.datetime(2021, 1, 1)
+
+    users = [{'discord_id': discord_id, 'display_name': 'user' + str(i)} for i, discord_id in enumerate(user_ids)]
+    transactions = [{'discord_id': discord_id, 'asset_code': 'USDOLLAR', 'volume': 10 ** 9, 'price_per_unit': 1,
+                     'is_sale': 0, 'is_crypto': 0, 'transaction_date': start} for discord_id in user_ids]
+    for i in range(max(0, args.transactions - len(user_ids))):
+        code, is_crypto, price = rng.choice(assets)
+        transactions.append({'discord_id': rng.choice(user_ids), 'asset_code': code,
+                             'volume': round(rng.uniform(0.1, 100), 4), 'price_per_unit': price * rng.uniform(0.8, 1.2),
+                             'is_sale': 0, 'is_crypto': is_crypto,
+                             'transaction_date': start + datetime.timedelta(seconds=i + 1)})
+    # Thresholds far enough from the current price that only about one in twenty triggers per pass.
+    alerts = []
+    for i in range(args.alerts):
+        code, is_crypto, price = rng.choice(assets)
+        is_less_than = rng.randint(0, 1)
+        factor = rng.uniform(0.5, 1.025) if is_less_than else rng.uniform(0.975, 1.5)
+        alerts.append({'channel_id': str(rng.randint(1, 50)), 'asset_code': code, 'price_per_unit': price * factor,
+                       'is_crypto': is_crypto, 'is_less_than': is_less_than})
+    orders = []
+    for i in range(args.orders):
+        code, is_crypto, price = rng.choice(assets)
+        is_less_than = rng.randint(0, 1)
+        factor = rng.uniform(0.5, 1.025) if is_less_than else rng.uniform(0.975, 1.5)
+        orders.append({'discord_id': rng.choice(user_ids), 'channel_id': str(rng.randint(1, 50)), 'asset_code': code,
+                       'volume': str(round(rng.uniform(0.1, 5), 2)), 'price_per_unit': price * factor, 'is_sale': 0,
+                       'is_crypto': is_crypto, 'is_less_than': is_less_than})
+
+    with database_connector.unit_of_work():
+        session.execute(database_connector.user.insert(), users)
+        session.execute(database_connector.transaction.insert(), transactions)
+        if alerts:
+            session.execute(database_connector.alert.insert(), alerts)
+        if orders:
+            session.execute(database_connector.limit_transaction.insert(), orders)
+    database_connector.backfill_holdings()
+    return user_ids
+
+
+async def run_benchmarks(args):
+    rng = random.Random(args.seed)
+    if args.payloads:
+        products, quotes = load_payloads(args.payloads)
+    else:
+        products, quotes = generate_payloads(args.stocks, args.cryptos, args.seed)
+    upstream = FakeUpstream(products, quotes, args.latency)
+    url = await upstream.start()
+
+    database_url = args.database_url
+    if database_url is None:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='stock_bot_bench'), 'bench.sqlite')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['CRYPTO_PRODUCTS_URL'] = url + '/get-products'
+    os.environ['STOCK_QUOTE_URL'] = url + '/quote'
+    # The production rate limits would dominate the timings; set PRICE_RATE_LIMIT to benchmark with them.
+    os.environ.setdefault('PRICE_RATE_LIMIT', '100000')
+    os.environ.setdefault('PRICE_RATE_BURST', '100000')
+
+    # Imported only now, since the modules read their configuration from the environment at import time.
+    from util import alerts, database_connector, engines, helpers, leaderboard, notifier, order_book, price_client
+
+    stock_prices = {q['symbol'].upper(): float(q['regularMarketPrice']) for q in quotes['quoteResponse']['result']}
+    crypto_prices = {p['b'].upper(): float(p['c']) for p in products['data'] if p['q'].upper() == 'USDT'}
+
+    results = {}
+    started = time.perf_counter()
+    database_connector.create_database()
+    user_ids = await database_connector.run(seed, database_connector, args, stock_prices, crypto_prices, rng)
+    database_connector.session.remove()
+    results['seed'] = {'seconds': round(time.perf_counter() - started, 3)}
+
+    async def transact():
+        code = rng.choice(list(stock_prices))
+        async with database_connector.scope():
+            await database_connector.run(helpers.transact_asset, rng.choice(user_ids), 'bench', code, '1',
+                                         str(stock_prices[code]), 0, 0)
+
+    async def check_balance():
+        async with database_connector.scope():
+            await helpers.check_balance(rng.choice(user_ids))
+
+    server_members = {int(discord_id): 'user' + str(i) for i, discord_id in enumerate(user_ids)}
+
+    async def leaderboard_refresh():
+        await leaderboard.refresh(force=True)
+
+    async def format_leaderboard():
+        async with database_connector.scope():
+            await leaderboard.format_leaderboard(server_members)
+
+    # The work of one check_alerts / check_limit_orders tick: the same engine passes the bot runs, with the
+    # notifications queued on an outbox that is never sent.
+    async def check_alerts():
+        async with database_connector.scope():
+            await alerts.ensure_loaded()
+            failed = set()
+            keys = alerts.price_keys()
+            prices = await helpers.get_prices(keys, failed=failed)
+            await engines.alert_pass(prices, notifier.Outbox(), failed, keys)
+
+    async def check_limit_orders():
+        async with database_connector.scope():
+            await order_book.ensure_loaded()
+            failed = set()
+            keys = order_book.price_keys()
+            prices = await helpers.get_prices(keys, failed=failed)
+            await engines.order_pass(prices, notifier.Outbox(), failed, keys)
+
+    for name, fn in [('transact_asset', transact),
+                     ('check_balance', check_balance),
+                     ('leaderboard_refresh', leaderboard_refresh),
+                     ('format_leaderboard', format_leaderboard),
+                     ('check_alerts', check_alerts),
+                     ('check_limit_orders', check_limit_orders)]:
+        requests_before = upstream.requests
+        samples = await measure(args.repeat, fn)
+        results[name] = dict(summarize(samples), first_ms=round(samples[0] * 1000, 3),
+                             upstream_requests=upstream.requests - requests_before)
+
+    await price_client.close()
+    await upstream.stop()
+    database_connector.executor.shutdown()
+    return {'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'config': {'users': args.users, 'transactions': args.transactions, 'alerts': args.alerts,
+                       'orders': args.orders, 'stocks': len(stock_prices), 'cryptos': len(crypto_prices),
+                       'latency': args.latency, 'repeat': args.repeat,
+                       'database': database_url.split(':', 1)[0]},
+            'results': results}
+
+
+def main():
+    args = parse_args()
+    report = json.dumps(asyncio.run(run_benchmarks(args)), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,81 @@
+import asyncio
 import os
+import time
 
 import discord
 import logging
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
-from urllib3.exceptions import NewConnectionError
 
-from util import database_connector, helpers
+load_dotenv()
+
+from util import alerts, database_connector, engines, helpers, leaderboard, metrics, notifier, order_book, \
+    price_feed as price_feeds, profiling, snapshots, symbols, tick_history, worker as worker_process
 
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix='!', help_command=None, intents=intents)
-load_dotenv()
 logging.basicConfig(filename='stock_bot_log.log', level=logging.INFO)
 
 TOKEN = os.getenv('TOKEN')
+# Runs one gateway shard per Discord's recommendation, for bots in many guilds.
+SHARDED = os.getenv('SHARDED', '') == '1'
+bot = (commands.AutoShardedBot if SHARDED else commands.Bot)(command_prefix='!', help_command=None, intents=intents)
+LIMIT_ORDER_INTERVAL = float(os.getenv('LIMIT_ORDER_INTERVAL', '15'))
+PRICE_STREAM = os.getenv('PRICE_STREAM', '')
+WSB_REFRESH_INTERVAL = float(os.getenv('WSB_REFRESH_INTERVAL', '600'))
+TICK_FLUSH_INTERVAL = float(os.getenv('TICK_FLUSH_INTERVAL', '60'))
 
 message_str = '{code} ({full_name}) : ${current_price} ' \
               'Daily Change: ${daily_change_amt} ({daily_change_percent}%){wsb_info}.'
 
 
+def stale_note(price_data):
+    return ' (last known price, quotes are delayed)' if price_data['is_stale'] else ''
+
+
 @bot.before_invoke
-async def wake(x):
-    database_connector.wake_up_db()
+async def start_command(ctx):
+    database_connector.open_scope()
+    ctx.command_stats, ctx.command_stats_token = metrics.start_stats()
+    ctx.command_started = time.perf_counter()
+    ctx.profile = profiling.start(ctx.command.qualified_name, ctx.message.content)
+
+
+@bot.after_invoke
+async def finish_command(ctx):
+    profiling.finish(ctx.profile, ctx.command_stats)
+    metrics.record_command(ctx.command.qualified_name, time.perf_counter() - ctx.command_started, ctx.command_stats,
+                           ctx.command_failed)
+    metrics.current_stats.reset(ctx.command_stats_token)
+    await database_connector.close_scope()
+
+
+# Sends header followed by rows in code blocks, split across as few messages as Discord's 2000 character limit allows.
+async def send_table(ctx, header, rows):
+    message = header
+    block = ''
+    for row in rows:
+        if len(message) + len(block) + len(row) + 8 > 2000:
+            await ctx.send(message + '```' + block + '```')
+            message = ''
+            block = ''
+        block += row + '\n'
+    if block:
+        message += '```' + block + '```'
+    if message:
+        await ctx.send(message)
+
+
+# Answers tickers the upstream recently returned no quote for, and unknown crypto codes, without an upstream request.
+async def reject_unknown_symbol(ctx, code, is_crypto):
+    if symbols.lookup(code, is_crypto) is not False:
+        return False
+    message = 'Unable to find price information for ' + code.upper()
+    asset_class = symbols.asset_class(code)
+    if asset_class is not None:
+        message += ' ({code} is a {asset_class}.)'.format(code=code.upper(), asset_class=asset_class)
+    await ctx.send(message)
+    return True
 
 
 @bot.command(name='help')
@@ -33,13 +86,17 @@ async def help_cmd(ctx, *args):
               "  xalert      Delete an alert. !xalert [id] *id comes from !alerts command.\n" \
               "  crypto      Shows the price of a given cryptocurrency. (ex. !crypto btc)\n" \
               "  stock       Shows the price of a given stock. (ex. !stock gme)\n" \
+              "  change      Price change over a period. !change [stock/crypto] [ticker] [period] (ex. 4h, 1d, 2w)\n" \
+              "  chart       Price chart over a period. !chart [stock/crypto] [ticker] [period]\n" \
               "  buy         Buy an asset. !buy [stock/crypto] [ticker] [amount]\n" \
               "  sell        Sell an asset. !sell [stock/crypto] [ticker] [amount]\n" \
               "  limit       !help limit for more info\n" \
               "  liquidate   Sell all assets at market value.\n" \
               "  portfolio   Shows all of your assets by volume.\n" \
-              "  history     Shows 10 most recent transactions.\n" \
-              "  leaderboard Shows ordered list of participants by portfolio value.\n" \
+              "  history     Shows your transactions, 10 per page. !history [page]\n" \
+              "  export      Sends your full transaction history as a CSV file.\n" \
+              "  leaderboard Shows participants by portfolio value, or by change with !lb [day/week/month].\n" \
+              "  performance Shows how your portfolio value changed. !performance [day/week/month]\n" \
               "  reset       Resets your account back to $50,000 USD." \
               "```"
     if len(args) > 0 and args[0] == 'limit':
@@ -57,45 +114,101 @@ async def help_cmd(ctx, *args):
     await ctx.send(message)
 
 
+@bot.command(name='stats')
+@commands.has_permissions(administrator=True)
+async def stats_cmd(ctx):
+    rows = metrics.summary({'stockbot_command_seconds', 'stockbot_upstream_seconds', 'stockbot_db_query_seconds',
+                            'stockbot_loop_tick_seconds'})
+    if not rows:
+        await ctx.send('No metrics recorded yet.')
+        return
+    await send_table(ctx, '', rows)
+
+
 @bot.command(name='setname')
 async def set_name_cmd(ctx, name):
     discord_id = ctx.message.author.id
-    database_connector.set_display_name(discord_id, name)
+    await database_connector.run(database_connector.set_display_name, discord_id, name)
+    leaderboard.set_name(discord_id, name)
 
 
 @bot.command(name='reset')
 async def reset(ctx):
-    database_connector.reset(ctx.message.author.id)
+    await database_connector.run(database_connector.reset, ctx.message.author.id)
     await ctx.send(ctx.message.author.name + '\'s Balance Reset to $50000.')
 
 
 @bot.command(name='stock', aliases=['s'])
 async def stock_price_cmd(ctx, code):
-    wsb_info = helpers.get_wsb_hits(code)
+    if await reject_unknown_symbol(ctx, code, 0):
+        return
     try:
-        price_data = helpers.get_stock_price_data(code)
+        wsb_info, price_data = await asyncio.gather(helpers.get_wsb_hits(code, budget=helpers.WSB_TIME_BUDGET),
+                                                    helpers.get_stock_price_data(code))
         await ctx.send(message_str.format(code=code.upper(),
                                           full_name=price_data['name'],
                                           current_price=str(round(float(price_data['current_price']), 2)),
                                           daily_change_amt=price_data['daily_change_amt'],
                                           daily_change_percent=price_data['daily_change_percent'],
-                                          wsb_info=wsb_info))
+                                          wsb_info=wsb_info + stale_note(price_data)))
     except Exception:
         await ctx.send('Unable to find price information for ' + code.upper())
 
 
 @bot.command(name='crypto', aliases=['c'])
 async def crypto_price_cmd(ctx, code):
+    if await reject_unknown_symbol(ctx, code, 1):
+        return
     try:
-        crypto_data = helpers.get_crypto_price_data(code)
+        crypto_data = await helpers.get_crypto_price_data(code)
         await ctx.send(message_str.format(code=code.upper(),
                                           full_name=crypto_data['name'],
                                           current_price=str(round(float(crypto_data['current_price']), 2)),
                                           daily_change_amt=crypto_data['daily_change_amt'],
                                           daily_change_percent=crypto_data['daily_change_percent'],
-                                          wsb_info=''))
+                                          wsb_info=stale_note(crypto_data)))
+    except Exception:
+        await ctx.send('Unable to find price information for ' + code.upper())
+
+
+# Parses the arguments of !change and !chart and fetches the current price, which is also recorded as a tick.
+# Returns (price_key, period seconds, price), or None after telling the user what went wrong.
+async def history_args(ctx, stock_crypto, code, period):
+    is_crypto = 0 if (stock_crypto.lower() == 'stock' or stock_crypto.lower() == 's') else 1
+    seconds = tick_history.parse_period(period)
+    if seconds is None:
+        await ctx.send('Unknown period ' + period + ', use minutes, hours, days or weeks (ex. 30m, 4h, 1d, 2w).')
+        return None
+    if await reject_unknown_symbol(ctx, code, is_crypto):
+        return None
+    try:
+        price = await helpers.get_price_of_asset(code, is_crypto)
     except Exception:
         await ctx.send('Unable to find price information for ' + code.upper())
+        return None
+    return helpers.price_key(code, is_crypto), seconds, price
+
+
+@bot.command(name='change')
+async def change_cmd(ctx, stock_crypto, code, period='1d'):
+    args = await history_args(ctx, stock_crypto, code, period)
+    if args is None:
+        return
+    key, seconds, price = args
+    await ctx.send(helpers.format_price_change(key, period, seconds, price))
+
+
+@bot.command(name='chart')
+async def chart_cmd(ctx, stock_crypto, code, period='1d'):
+    args = await history_args(ctx, stock_crypto, code, period)
+    if args is None:
+        return
+    key, seconds, price = args
+    chart = helpers.format_chart(key, period, seconds)
+    if chart is None:
+        await ctx.send('No price history for ' + key[0] + ' yet, try again later.')
+        return
+    await send_table(ctx, *chart)
 
 
 @bot.command(name='buy')
@@ -103,19 +216,25 @@ async def buy_cmd(ctx, stock_crypto, code, amount):
     discord_id = ctx.message.author.id
     discord_name = ctx.message.author.name
     is_crypto = 0 if (stock_crypto.lower() == 'stock' or stock_crypto.lower() == 's') else 1
+    if await reject_unknown_symbol(ctx, code, is_crypto):
+        return
     if not is_crypto:
         try:
-            purchase_price = helpers.get_stock_price_data(code)['current_price']
+            price_data = await helpers.get_stock_price_data(code)
         except Exception:
             await ctx.send('Unable to find price information for ' + code.upper())
             return
     else:
         try:
-            purchase_price = helpers.get_crypto_price_data(code)['current_price']
+            price_data = await helpers.get_crypto_price_data(code)
         except Exception:
             await ctx.send('Unable to find price information for ' + code.upper())
             return
-    await ctx.send(helpers.transact_asset(discord_id, discord_name, code, amount, purchase_price, 0, is_crypto))
+    if price_data['is_stale']:
+        await ctx.send('Prices for ' + code.upper() + ' are temporarily unavailable, try again shortly.')
+        return
+    await ctx.send(await database_connector.run(helpers.transact_asset, discord_id, discord_name, code, amount,
+                                                price_data['current_price'], 0, is_crypto))
 
 
 @bot.command(name='sell')
@@ -123,41 +242,53 @@ async def sell_cmd(ctx, stock_crypto, code, amount):
     discord_id = ctx.message.author.id
     discord_name = ctx.message.author.name
     is_crypto = 0 if (stock_crypto.lower() == 'stock' or stock_crypto.lower() == 's') else 1
+    if await reject_unknown_symbol(ctx, code, is_crypto):
+        return
     if not is_crypto:
         try:
-            purchase_price = helpers.get_stock_price_data(code)['current_price']
+            price_data = await helpers.get_stock_price_data(code)
         except Exception:
             await ctx.send('Unable to find price information for ' + code.upper())
             return
     else:
         try:
-            purchase_price = helpers.get_crypto_price_data(code)['current_price']
+            price_data = await helpers.get_crypto_price_data(code)
         except Exception:
             await ctx.send('Unable to find price information for ' + code.upper())
             return
-    await ctx.send(helpers.transact_asset(discord_id, discord_name, code, amount, purchase_price, 1, is_crypto))
+    if price_data['is_stale']:
+        await ctx.send('Prices for ' + code.upper() + ' are temporarily unavailable, try again shortly.')
+        return
+    await ctx.send(await database_connector.run(helpers.transact_asset, discord_id, discord_name, code, amount,
+                                                price_data['current_price'], 1, is_crypto))
 
 
 @bot.command(name='liquidate', aliases=['liq'])
 async def liquidate_cmd(ctx):
     discord_id = ctx.message.author.id
     discord_name = ctx.message.author.name
-    assets = database_connector.get_all_assets(ctx.message.author.id)
-    for asset in assets:
-        if asset['name'].lower() == 'usdollar':
+    assets = [a for a in await database_connector.run(database_connector.get_all_assets, discord_id)
+              if a['name'] != 'USDOLLAR']
+    # Stale prices are not used: an asset whose price cannot be fetched right now is left unsold.
+    prices = await helpers.get_prices(((a['name'], a['is_crypto']) for a in assets), failed=set())
+    legs = []
+    unpriced = []
+    for a in assets:
+        price = prices.get(helpers.price_key(a['name'], a['is_crypto']))
+        if price is None:
+            unpriced.append(a['name'].upper())
             continue
-        if asset['is_crypto']:
-            price = helpers.get_crypto_price_data(asset['name'])['current_price']
-        else:
-            price = helpers.get_stock_price_data(asset['name'])['current_price']
-        await ctx.send(helpers.transact_asset(discord_id, discord_name, asset['name'],
-                                              'max', price, 1, asset['is_crypto']))
-    await ctx.send('All assets sold.')
+        legs.append({'asset': a['name'], 'volume': 'max', 'price_per_unit': str(price), 'is_sale': 1,
+                     'is_crypto': a['is_crypto']})
+    summary, rows = await database_connector.run(helpers.transact_assets, discord_id, discord_name, legs)
+    if unpriced:
+        summary += ' Unable to find price information for {assets}, not sold.'.format(assets=', '.join(unpriced))
+    await send_table(ctx, summary, rows)
 
 
 @bot.command(name='portfolio', aliases=['pf'])
 async def portfolio_cmd(ctx, *args):
-    users = database_connector.get_all_users()
+    users = await database_connector.run(database_connector.get_all_users)
     if len(args) != 0:
         user_id = ''
         for m in ctx.message.guild.members:
@@ -170,12 +301,12 @@ async def portfolio_cmd(ctx, *args):
         if user_id == '':
             await ctx.send('Can \'t find portfolio for ' + args[0])
             return
-        pages = helpers.format_portfolio(helpers.check_balance(user_id))
+        pages = helpers.format_portfolio(await helpers.check_balance(user_id))
         for index, page in enumerate(pages):
             await ctx.send("```" + args[0] + '\'s Portfolio (Page {page}):\n'.format(page=str(index + 1)) +
                            page + "```")
     else:
-        pages = helpers.format_portfolio(helpers.check_balance(ctx.message.author.id))
+        pages = helpers.format_portfolio(await helpers.check_balance(ctx.message.author.id))
         for index, page in enumerate(pages):
             await ctx.send(
                 "```" + ctx.message.author.name + '\'s Portfolio (Page {page}):\n'.format(page=str(index + 1)) +
@@ -183,22 +314,64 @@ async def portfolio_cmd(ctx, *args):
 
 
 @bot.command(name='history')
-async def history_cmd(ctx):
-    await ctx.send("```" + helpers.format_transaction_history(ctx.message.author.id) + "```")
+async def history_cmd(ctx, position=None):
+    await ctx.send("```" + await database_connector.run(helpers.format_transaction_history, ctx.message.author.id,
+                                                        position) + "```")
+
+
+@bot.command(name='export')
+async def export_cmd(ctx):
+    path, count = await database_connector.run(helpers.export_transactions, ctx.message.author.id)
+    try:
+        size = os.path.getsize(path)
+        limit = ctx.guild.filesize_limit if ctx.guild is not None else 8 * 1024 * 1024
+        if count == 0:
+            await ctx.send('You have no transactions to export.')
+        elif size > limit:
+            await ctx.send('Your transaction history is too large to upload here ({size:,} bytes).'.format(size=size))
+        else:
+            await ctx.send('{name}\'s transactions ({count}).'.format(name=ctx.message.author.name, count=count),
+                           file=discord.File(path, filename='transactions.csv'))
+    finally:
+        os.remove(path)
 
 
 @bot.command(name='leaderboard', aliases=['lb'])
-async def leaderboard_cmd(ctx):
+async def leaderboard_cmd(ctx, period=None):
     mem_dict = {}
     for m in ctx.message.guild.members:
         mem_dict[m.id] = m.name
-    await ctx.send("```" + helpers.format_leaderboard(mem_dict) + "```")
+    if period is None:
+        await ctx.send("```" + await leaderboard.format_leaderboard(mem_dict) + "```")
+        return
+    seconds = snapshots.parse_period(period)
+    if seconds is None:
+        await ctx.send('Unknown period ' + period + ', use day, week or month.')
+        return
+    await ctx.send("```" + await database_connector.run(snapshots.format_period_leaderboard, mem_dict, period,
+                                                        seconds) + "```")
+
+
+@bot.command(name='performance', aliases=['perf'])
+async def performance_cmd(ctx, period='week'):
+    seconds = snapshots.parse_period(period)
+    if seconds is None:
+        await ctx.send('Unknown period ' + period + ', use day, week or month.')
+        return
+    performance = await database_connector.run(snapshots.format_performance, ctx.message.author.id,
+                                               ctx.message.author.name, period, seconds)
+    if performance is None:
+        await ctx.send('No portfolio snapshots for the last ' + period + ' yet.')
+        return
+    await send_table(ctx, *performance)
 
 
 @bot.command(name='alert', aliases=['a'])
 async def alert_cmd(ctx, stock_crypto, code, direction, price):
     channel_id = ctx.channel.id
     is_crypto = 0 if (stock_crypto.lower() == 'stock' or stock_crypto.lower() == 's') else 1
+    if await reject_unknown_symbol(ctx, code, is_crypto):
+        return
     price = price.replace('$', '').replace(',', '')
     if direction == '<':
         direction = 1
@@ -207,23 +380,26 @@ async def alert_cmd(ctx, stock_crypto, code, direction, price):
     else:
         return
 
-    database_connector.create_alert(channel_id=channel_id,
-                                    asset=code,
-                                    is_crypto=is_crypto,
-                                    is_less_than=direction,
-                                    price=price)
+    result = await database_connector.run(database_connector.create_alert,
+                                          channel_id=channel_id,
+                                          asset=code,
+                                          is_crypto=is_crypto,
+                                          is_less_than=direction,
+                                          price=price)
+    if result.get('is_successful'):
+        alerts.add_alert(result['id'], channel_id, code, is_crypto, direction, price)
 
-    await ctx.send(helpers.format_alerts(ctx.channel.id))
+    await ctx.send(await database_connector.run(helpers.format_alerts, ctx.channel.id))
 
 
 @bot.command(name='alerts')
 async def alerts_cmd(ctx):
-    await ctx.send(helpers.format_alerts(ctx.channel.id))
+    await ctx.send(await database_connector.run(helpers.format_alerts, ctx.channel.id))
 
 
 @bot.command(name='xalert')
 async def delete_alert_cmd(ctx, alert_id):
-    database_connector.delete_alert(alert_id)
+    await alerts.delete_alert(int(alert_id))
     await ctx.send('Alert Deleted.')
 
 
@@ -233,6 +409,8 @@ async def limit_order_cmd(ctx, buy_sell, stock_crypto, amount, code, direction,
     discord_id = ctx.message.author.id
     is_crypto = 0 if (stock_crypto.lower() == 'stock' or stock_crypto.lower() == 's') else 1
     is_sale = 0 if (buy_sell.lower() == 'buy' or buy_sell.lower() == 'b') else 1
+    if await reject_unknown_symbol(ctx, code, is_crypto):
+        return
     price = price.replace('$', '').replace(',', '')
     if direction == '<':
         direction = 1
@@ -241,7 +419,8 @@ async def limit_order_cmd(ctx, buy_sell, stock_crypto, amount, code, direction,
     else:
         return
 
-    database_connector.create_limit_order(discord_id=discord_id,
+    result = await database_connector.run(database_connector.create_limit_order,
+                                          discord_id=discord_id,
                                           channel_id=channel_id,
                                           asset=code,
                                           volume=amount,
@@ -249,97 +428,204 @@ async def limit_order_cmd(ctx, buy_sell, stock_crypto, amount, code, direction,
                                           is_sale=is_sale,
                                           is_less_than=direction,
                                           price=price)
+    if result.get('is_successful'):
+        order_book.add_order(result['id'], discord_id, channel_id, code, amount, is_crypto, is_sale, direction, price)
 
-    await ctx.send(helpers.format_limit_orders(discord_id))
+    await ctx.send(await database_connector.run(helpers.format_limit_orders, discord_id))
 
 
 @bot.command(name='orders')
 async def orders_cmd(ctx):
-    await ctx.send(helpers.format_limit_orders(ctx.message.author.id))
+    await ctx.send(await database_connector.run(helpers.format_limit_orders, ctx.message.author.id))
 
 
 @bot.command(name='xorder')
 async def delete_order_cmd(ctx, order_id):
-    database_connector.delete_limit_order(order_id, ctx.message.author.id)
+    await order_book.delete_order(int(order_id), ctx.message.author.id)
     await ctx.send('Order Deleted.')
 
 
 '''BACKGROUND TASKS'''
 
 
+def channel_visible(channel_id):
+    return bot.get_channel(channel_id) is not None
+
+
+def member_name(discord_id):
+    member = bot.get_user(int(discord_id))
+    return member.name if member is not None else None
+
+
+async def process_alerts(prices, failed=(), keys=None):
+    outbox = notifier.Outbox()
+    await engines.alert_pass(prices, outbox, failed, keys, channel_visible)
+    await outbox.flush(bot.get_channel)
+
+
+async def process_limit_orders(prices, failed=(), keys=None):
+    outbox = notifier.Outbox()
+    await engines.order_pass(prices, outbox, failed, keys, channel_visible, member_name)
+    await outbox.flush(bot.get_channel)
+
+
+# Assets the price stream pushes are handled by on_stream_prices; the loops only poll for the rest.
+def polled_keys(keys):
+    return [key for key in keys if price_feed is None or not price_feed.covers(key)]
+
+
+async def on_stream_prices(prices):
+    tick_history.record(prices)
+    with metrics.loop_tick('price_stream') as stats, profiling.profiled('price_stream', stats):
+        async with database_connector.scope():
+            outbox = notifier.Outbox()
+            await engines.stream_pass(prices, outbox, channel_visible, member_name)
+            await outbox.flush(bot.get_channel)
+
+
+# In worker mode the engines, and the price stream feeding them, live in the worker process started below.
+worker = None
+price_feed = price_feeds.create_feed(PRICE_STREAM) if worker_process.WORKER_MODE != 'process' else None
+if price_feed is not None:
+    price_feed.subscribe(on_stream_prices)
+
+
+def send_visible_channels():
+    if worker is not None:
+        worker.send('channels', [channel.id for channel in bot.get_all_channels()])
+
+
+# The worker cannot look users up itself: it names users who never ran !setname from the names sent here.
+def send_member_names(users):
+    if worker is not None:
+        worker.send('names', {str(u.id): u.name for u in users})
+
+
+metrics_server = None
+
+
+@bot.event
+async def on_ready():
+    global metrics_server
+    if price_feed is not None:
+        price_feed.start()
+    send_visible_channels()
+    send_member_names(bot.users)
+    if metrics.METRICS_PORT and metrics_server is None:
+        metrics_server = await metrics.start_http_server()
+
+
+@bot.event
+async def on_guild_join(guild):
+    send_visible_channels()
+    send_member_names(guild.members)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    send_visible_channels()
+
+
+@bot.event
+async def on_guild_channel_create(channel):
+    send_visible_channels()
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    send_visible_channels()
+
+
+@bot.event
+async def on_member_join(member):
+    send_member_names([member])
+
+
 @tasks.loop(seconds=10)
 async def check_alerts():
-    alerts = database_connector.get_all_alerts()
-    for a in alerts:
-        print('Checking alert ' + str(a))
-        channel = bot.get_channel(int(a.channel_id))
-        if channel is None:
-            return
-        try:
-            current_price = helpers.get_crypto_price_data(a.asset_code)['current_price'] if a.is_crypto \
-                else helpers.get_stock_price_data(a.asset_code)['current_price']
-        except NewConnectionError as e:
-            logging.error('Error with alert: ' + str(e))
-            return
-        except Exception as e:
-            await channel.send('Issue with alert ' + str(a.id) + ' it will be deleted.')
-            await channel.send(helpers.format_alerts(a.channel_id))
-            logging.error('Error with alert: ' + str(e))
-            database_connector.delete_alert(a.id)
-            return
-        if a.is_less_than:
-            if float(current_price) < float(a.price_per_unit):
-                await channel.send('```PRICE ALERT: {asset} below {alert_price}! Current price: {current_price}.```'
-                                   .format(asset=a.asset_code.upper(),
-                                           alert_price=str(round(a.price_per_unit, 2)),
-                                           current_price=str(round(float(current_price), 2))))
-                database_connector.delete_alert(a.id)
-        else:
-            if float(current_price) > float(a.price_per_unit):
-                await channel.send('```PRICE ALERT: {asset} above {alert_price}! Current price: {current_price}.```'
-                                   .format(asset=a.asset_code.upper(),
-                                           alert_price=str(round(a.price_per_unit, 2)),
-                                           current_price=str(round(float(current_price), 2))))
-                database_connector.delete_alert(a.id)
+    with metrics.loop_tick('check_alerts') as stats, profiling.profiled('check_alerts', stats):
+        async with database_connector.scope():
+            await alerts.ensure_loaded()
+            failed = set()
+            keys = polled_keys(alerts.price_keys())
+            prices = await helpers.get_prices(keys, failed=failed)
+            await process_alerts(prices, failed, keys)
 
 
-@tasks.loop(minutes=5)
+@tasks.loop(seconds=LIMIT_ORDER_INTERVAL)
 async def check_limit_orders():
-    orders = database_connector.get_limit_orders(None)
-    for o in orders:
-        display_name = database_connector.get_display_name(o.discord_id)
-        channel = bot.get_channel(int(o.channel_id))
-        if channel is None:
-            return
+    with metrics.loop_tick('check_limit_orders') as stats, profiling.profiled('check_limit_orders', stats):
+        async with database_connector.scope():
+            await order_book.ensure_loaded()
+            failed = set()
+            keys = polled_keys(order_book.price_keys())
+            prices = await helpers.get_prices(keys, failed=failed)
+            await process_limit_orders(prices, failed, keys)
 
-        try:
-            current_price = helpers.get_crypto_price_data(o.asset_code)['current_price'] if o.is_crypto \
-                else helpers.get_stock_price_data(o.asset_code)['current_price']
-        except NewConnectionError as e:
-            logging.error('Error with order: ' + str(e))
-            return
-        except Exception as e:
-            await channel.send('Issue with ' + display_name + '\'s order ' + str(o.id) + ' it will be deleted.')
-            await channel.send(helpers.format_limit_orders(o.discord_id))
-            logging.error('Error with order: ' + str(e))
-            database_connector.delete_limit_order(o.id, o.discord_id)
-            return
-        if o.is_less_than:
-            if float(current_price) < float(o.price_per_unit):
-                await channel.send(helpers.transact_asset(o.discord_id, display_name,
-                                                          o.asset_code, o.volume, current_price, o.is_sale,
-                                                          o.is_crypto))
-                database_connector.delete_limit_order(o.id, o.discord_id)
-        else:
-            if float(current_price) > float(o.price_per_unit):
-                await channel.send(helpers.transact_asset(o.discord_id, display_name,
-                                                          o.asset_code, o.volume, current_price, o.is_sale,
-                                                          o.is_crypto))
-                database_connector.delete_limit_order(o.id, o.discord_id)
+
+@tasks.loop(hours=1)
+async def refresh_symbols():
+    with metrics.loop_tick('refresh_symbols') as stats, profiling.profiled('refresh_symbols', stats):
+        await symbols.refresh_stock_symbols()
+
+
+@tasks.loop(seconds=WSB_REFRESH_INTERVAL)
+async def refresh_wsb_hits():
+    with metrics.loop_tick('refresh_wsb_hits') as stats, profiling.profiled('refresh_wsb_hits', stats):
+        await helpers.refresh_wsb_hits()
+
+
+# Sends the notifications the worker queued, merged per channel, applies its fills to the leaderboard and records
+# the prices it published in the tick history.
+@tasks.loop(seconds=1)
+async def relay_worker_events():
+    for key, (price, updated) in worker.board.entries().items():
+        tick_history.record({key: price}, updated)
+    outbox = notifier.Outbox()
+    for event in worker.drain():
+        if event[0] == 'message':
+            outbox.add(event[1], event[2])
+        elif event[0] == 'trade':
+            database_connector.notify_trade(event[1])
+    await outbox.flush(bot.get_channel)
+
+
+@tasks.loop(seconds=snapshots.SNAPSHOT_INTERVAL)
+async def take_snapshots():
+    with metrics.loop_tick('take_snapshots') as stats, profiling.profiled('take_snapshots', stats):
+        await snapshots.take_snapshot()
+
+
+# Writes the ticks recorded since the last flush to the history segments, so a restart loses at most this interval.
+@tasks.loop(seconds=TICK_FLUSH_INTERVAL)
+async def flush_ticks():
+    await asyncio.get_event_loop().run_in_executor(None, tick_history.history.flush_all)
+
+
+@tasks.loop(seconds=metrics.METRICS_INTERVAL)
+async def write_metrics():
+    await asyncio.get_event_loop().run_in_executor(None, metrics.write_file)
 
 
 '''Execution'''
 
-check_alerts.start()
-check_limit_orders.start()
-bot.run(TOKEN)
+if __name__ == '__main__':
+    if worker_process.WORKER_MODE == 'process':
+        worker = worker_process.WorkerHandle(PRICE_STREAM)
+        worker.start()
+        relay_worker_events.start()
+    else:
+        check_alerts.start()
+        check_limit_orders.start()
+    refresh_symbols.start()
+    refresh_wsb_hits.start()
+    flush_ticks.start()
+    take_snapshots.start()
+    if metrics.METRICS_FILE:
+        write_metrics.start()
+    try:
+        bot.run(TOKEN)
+    finally:
+        tick_history.history.flush_all()
+        if worker is not None:
+            worker.stop()
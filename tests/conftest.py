@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules under test import util.database_connector, which connects on import. A file database rather than
+# sqlite:// so the DB thread pool's connections all see the same tables.
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# A freshly created and migrated database per test.
+@pytest.fixture
+def db():
+    from util import database_connector
+    database_connector.session.remove()
+    database_connector.meta.drop_all(database_connector.engine)
+    database_connector.create_database()
+    yield database_connector
+    database_connector.session.remove()
@@ -0,0 +1,51 @@
+import asyncio
+
+from sqlalchemy import event
+
+from util import alerts, engines, notifier, symbols, trigger_index
+
+
+def test_triggered_orders_crossings():
+    index = trigger_index.TriggerIndex()
+    for item_id, threshold in [(1, 50), (2, 70), (3, 60)]:
+        index.add(item_id, ('GME', 0), True, threshold)
+    for item_id, threshold in [(4, 30), (5, 10), (6, 80)]:
+        index.add(item_id, ('GME', 0), False, threshold)
+    assert index.triggered(('GME', 0), 55) == [2, 3, 5, 4]
+    assert index.triggered(('GME', 0), 70) == [5, 4]
+    assert index.triggered(('AMC', 0), 55) == []
+
+
+def test_alert_pass_deletes_fired_and_invalid_alerts_in_one_statement(db, monkeypatch):
+    monkeypatch.setattr(alerts, 'loaded', False)
+    monkeypatch.setattr(symbols, 'unknown', {})
+    below = db.create_alert(5, 'GME', 0, 1, 50)['id']
+    db.create_alert(5, 'GME', 0, 0, 100)
+    unknown = db.create_alert(5, 'XYZ', 0, 0, 1)['id']
+    hidden = db.create_alert(6, 'GME', 0, 1, 50)['id']
+    symbols.mark_unknown('XYZ', 0)
+    deletes = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('DELETE'):
+            deletes.append(parameters)
+
+    async def run():
+        async with db.scope():
+            await alerts.ensure_loaded()
+            outbox = notifier.Outbox()
+            await engines.alert_pass({('GME', 0): 40.0}, outbox, is_visible=lambda channel_id: channel_id == 5)
+            return outbox
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        outbox = asyncio.run(run())
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert len(deletes) == 1
+    assert sorted(a.id for a in db.get_all_alerts()) == sorted(set(range(1, 5)) - {below, unknown})
+    assert below not in alerts.alerts and unknown not in alerts.alerts and hidden in alerts.alerts
+    texts = outbox.messages[5]
+    assert texts[0] == 'Issue with alert {id} it will be deleted.'.format(id=unknown)
+    assert 'PRICE ALERT: GME below 50.0! Current price: 40.0.' in texts[-1]
+    assert 6 not in outbox.messages
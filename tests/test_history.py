@@ -0,0 +1,60 @@
+import csv
+import os
+
+from util import helpers
+
+
+def make_ledger(db, monkeypatch, trades):
+    monkeypatch.setattr(helpers, 'HISTORY_PAGE_SIZE', 10)
+    monkeypatch.setattr(helpers, 'EXPORT_BATCH_SIZE', 7)
+    monkeypatch.setattr(helpers, 'history_pages', {})
+    db.initialize_new_user('1')
+    for i in range(trades):
+        helpers.transact_asset('1', 'bob', 'GME', '1', str(i + 1), 0, 0)
+
+
+def test_history_pages_and_cursors(db, monkeypatch):
+    make_ledger(db, monkeypatch, 29)
+    first = helpers.format_transaction_history('1').split('\n')
+    assert first[0] == 'Recent Transactions:' and len(first) == 1 + 10 + 2
+    assert 'at 29.000/GME' in first[1]
+    cursor = first[-1].split(' ')[-1]
+    assert first[-1] == 'Older: !history 2 or !history ' + cursor
+
+    second = helpers.format_transaction_history('1', '2').split('\n')
+    assert second[1:11] == helpers.format_transaction_history('1', cursor).split('\n')[1:11]
+    assert 'at 19.000/GME' in second[1]
+
+    # The ledger ends exactly on page 3.
+    third = helpers.format_transaction_history('1', '3').split('\n')
+    assert len(third) == 1 + 10 and 'USDOLLAR' in third[-1]
+    assert helpers.format_transaction_history('1', '4') == 'You have no transactions on page 4.'
+
+    db.initialize_new_user('2')
+    other = db.get_transaction_history('2')[0].id
+    assert helpers.format_transaction_history('1', '@' + str(other)) == 'Unknown history cursor @{id}.'.format(id=other)
+    assert helpers.format_transaction_history('1', 'x') == 'Use !history [page] or !history @[cursor].'
+
+
+def test_deep_pages_after_a_trade(db, monkeypatch):
+    make_ledger(db, monkeypatch, 24)
+    assert helpers.format_transaction_history('1', '3').count('\n') == 5
+    assert '1' in helpers.history_pages
+    helpers.transact_asset('1', 'bob', 'AMC', '1', '1', 0, 0)
+    assert '1' not in helpers.history_pages
+    assert helpers.format_transaction_history('1', '3').count('\n') == 6
+
+
+def test_export_streams_the_whole_ledger_oldest_first(db, monkeypatch):
+    make_ledger(db, monkeypatch, 29)
+    path, count = helpers.export_transactions('1')
+    try:
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+    finally:
+        os.remove(path)
+    assert count == 30 and len(rows) == 31
+    assert rows[0][:4] == ['id', 'date', 'action', 'asset']
+    ids = [int(r[0]) for r in rows[1:]]
+    assert ids == sorted(ids) and len(set(ids)) == 30
+    assert rows[1][3] == 'USDOLLAR' and rows[-1][2:4] == ['buy', 'GME']
@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+from util import helpers
+
+
+def test_trades_update_the_holding_incrementally(db):
+    db.initialize_new_user('1')
+    helpers.transact_asset('1', 'bob', 'GME', '10', '20', 0, 0)
+    helpers.transact_asset('1', 'bob', 'GME', '10', '40', 0, 0)
+    assert db.get_asset_units('1', 'GME') == (Decimal(20), Decimal(30))
+    assert db.get_asset_units('1', 'USDOLLAR')[0] == Decimal(49400)
+
+    helpers.transact_asset('1', 'bob', 'GME', '5', '50', 1, 0)
+    assert db.get_asset_units('1', 'GME') == (Decimal(15), Decimal(30))
+    helpers.transact_asset('1', 'bob', 'GME', 'max', '10', 1, 0)
+    assert db.get_asset_units('1', 'GME') == (Decimal(0), Decimal(0))
+
+
+def test_backfill_matches_the_incremental_holdings(db):
+    db.initialize_new_user('1')
+    db.initialize_new_user('2')
+    helpers.transact_asset('1', 'bob', 'GME', '3', '10', 0, 0)
+    helpers.transact_asset('1', 'bob', 'GME', '1', '30', 0, 0)
+    helpers.transact_asset('1', 'bob', 'GME', '2', '25', 1, 0)
+    helpers.transact_asset('2', 'amy', 'btc', '0.5', '100', 0, 1)
+    incremental = db.get_positions()
+
+    db.session.execute(db.holding.delete())
+    db.backfill_holdings()
+    assert db.get_positions() == incremental
+    assert db.get_asset_units('1', 'GME') == (Decimal(2), Decimal(15))
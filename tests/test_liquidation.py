@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+from util import helpers
+
+
+def ledger_size(db):
+    return db.session.execute(select([func.count()]).select_from(db.transaction)).scalar()
+
+
+def setup_positions(db):
+    db.initialize_new_user('1')
+    helpers.transact_asset('1', 'bob', 'GME', '2', '10', 0, 0)
+    helpers.transact_asset('1', 'bob', 'btc', '1', '100', 0, 1)
+
+
+def sell_all(price_gme, price_btc):
+    return [{'asset': 'GME', 'volume': 'max', 'price_per_unit': price_gme, 'is_sale': 1, 'is_crypto': 0},
+            {'asset': 'BTC', 'volume': 'max', 'price_per_unit': price_btc, 'is_sale': 1, 'is_crypto': 1}]
+
+
+def test_make_transactions_applies_every_leg(db):
+    setup_positions(db)
+    result = db.make_transactions('1', sell_all('15', '150'))
+    assert result['is_successful']
+    assert [(f['asset'], f['profit_loss']) for f in result['fills']] == [('GME', Decimal(10)), ('BTC', Decimal(50))]
+    assert [p['name'] for p in db.get_positions(['1'])['1']] == ['USDOLLAR']
+    assert db.get_asset_units('1', 'USDOLLAR')[0] == Decimal(50060)
+
+
+def test_make_transactions_rolls_back_the_whole_batch(db, monkeypatch):
+    setup_positions(db)
+    before = (ledger_size(db), db.get_positions(['1']))
+
+    legs = sell_all('15', '150') + [{'asset': 'AMC', 'volume': '1', 'price_per_unit': '5', 'is_sale': 1,
+                                     'is_crypto': 0}]
+    result = db.make_transactions('1', legs)
+    assert result['message'] == 'Insufficient Shares' and result['asset'] == 'AMC'
+    assert (ledger_size(db), db.get_positions(['1'])) == before
+
+    set_holding = db.set_holding
+
+    def fail_on_btc(discord_id, asset, *args):
+        if asset == 'BTC':
+            raise RuntimeError('connection lost')
+        set_holding(discord_id, asset, *args)
+
+    monkeypatch.setattr(db, 'set_holding', fail_on_btc)
+    assert db.make_transactions('1', sell_all('15', '150'))['message'] == 'Database Error'
+    assert (ledger_size(db), db.get_positions(['1'])) == before
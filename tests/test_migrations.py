@@ -0,0 +1,21 @@
+from sqlalchemy import func, inspect, select
+
+
+def test_migrate_applies_each_step_once(db):
+    versions = db.session.execute(select([db.schema_version.c.version]).order_by(db.schema_version.c.version))
+    assert [row.version for row in versions] == [version for version, description, step in db.MIGRATIONS]
+    assert db.migrate() == db.MIGRATIONS[-1][0]
+    assert db.session.execute(select([func.count()]).select_from(db.schema_version)).scalar() == len(db.MIGRATIONS)
+
+
+def test_migrate_restores_missing_indexes(db):
+    db.engine.execute('DROP INDEX ix_transaction_user_date')
+    db.engine.execute(db.schema_version.delete())
+    db.migrate()
+    assert 'ix_transaction_user_date' in {i['name'] for i in inspect(db.engine).get_indexes('transaction')}
+
+
+def test_hot_queries_use_indexes(db):
+    assert db.check_query_plans() == []
+    db.engine.execute('DROP INDEX ix_alert_channel')
+    assert any(problem.startswith('alerts by channel') for problem in db.check_query_plans())
@@ -0,0 +1,52 @@
+import asyncio
+
+from util import notifier
+
+
+def test_merge_packs_texts_under_the_limit():
+    assert notifier.merge(['a', 'b', 'c'], limit=3) == ['a\nb', 'c']
+    assert notifier.merge([]) == []
+
+
+def test_split_prefers_line_breaks_and_hard_cuts_long_lines():
+    assert notifier.split('aaaa\nbb\ncc', 5) == ['aaaa', 'bb\ncc']
+    assert notifier.split('abcdefgh', 3) == ['abc', 'def', 'gh']
+
+
+def test_split_closes_and_reopens_code_blocks():
+    text = 'Header\n```' + ''.join('\nrow {i:03d} ' .format(i=i) + 'x' * 20 for i in range(40)) + '\n```\nFooter'
+    parts = notifier.split(text, 200)
+    assert len(parts) > 1
+    for part in parts:
+        assert len(part) <= 200
+        assert part.count('```') % 2 == 0
+    assert parts[0].startswith('Header\n```')
+    assert parts[-1].endswith('```\nFooter')
+    rows = [line for part in parts for line in part.split('\n') if line.startswith('row')]
+    assert rows == [line for line in text.split('\n') if line.startswith('row')]
+
+
+def test_split_hard_cuts_long_lines_inside_code_blocks():
+    parts = notifier.split('```\n' + 'y' * 50 + '\n```', 20)
+    assert all(len(part) <= 20 and part.count('```') == 2 for part in parts)
+    assert ''.join(part.replace('```', '').replace('\n', '') for part in parts) == 'y' * 50
+
+
+def test_outbox_sends_one_merged_message_per_channel():
+    sent = {}
+
+    class Channel:
+        def __init__(self, channel_id):
+            self.channel_id = channel_id
+
+        async def send(self, text):
+            sent.setdefault(self.channel_id, []).append(text)
+
+    outbox = notifier.Outbox()
+    outbox.add(5, 'first')
+    outbox.add('5', 'second')
+    outbox.add(6, 'third')
+    outbox.add(7, 'lost')
+    asyncio.run(outbox.flush(lambda channel_id: Channel(channel_id) if channel_id != 7 else None))
+    assert sent == {5: ['first\nsecond'], 6: ['third']}
+    assert len(outbox) == 0
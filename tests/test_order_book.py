@@ -0,0 +1,57 @@
+import asyncio
+
+from sqlalchemy import event
+
+from util import engines, notifier, order_book, symbols
+
+
+def test_fill_deletes_completed_orders_when_a_later_fill_raises(db, monkeypatch):
+    monkeypatch.setattr(order_book, 'loaded', False)
+    db.initialize_new_user('1')
+    good = db.create_limit_order('1', 5, 'GME', '2', 0, 0, 1, 50)['id']
+    bad = db.create_limit_order('1', 5, 'AMC', 'two', 0, 0, 1, 50)['id']
+
+    async def run():
+        async with db.scope():
+            await order_book.ensure_loaded()
+            triggered, invalid = order_book.match({('GME', 0): 40.0, ('AMC', 0): 40.0})
+            return await order_book.fill(triggered, {'1': 'bob'})
+
+    fills = dict((o['id'], message) for o, message in asyncio.run(run()))
+    assert fills[good].startswith('bob bought 2.0000 GME')
+    assert fills[bad] == 'Issue filling bob\'s order {id}, it was not executed.'.format(id=bad)
+    assert [o.id for o in db.get_limit_orders(None)] == [bad]
+    assert not order_book.orders
+
+
+def test_order_pass_deletes_invalid_orders_in_one_statement(db, monkeypatch):
+    monkeypatch.setattr(order_book, 'loaded', False)
+    monkeypatch.setattr(symbols, 'unknown', {})
+    db.initialize_new_user('1')
+    db.set_display_name('1', 'bob')
+    invalid = [db.create_limit_order('1', 5, code, '1', 0, 0, 1, 50)['id'] for code in ['XYZ', 'XYZ', 'QQQQQ']]
+    kept = db.create_limit_order('1', 5, 'GME', '1', 0, 0, 1, 50)['id']
+    for code in ['XYZ', 'QQQQQ']:
+        symbols.mark_unknown(code, 0)
+    deletes = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('DELETE'):
+            deletes.append(parameters)
+
+    async def run():
+        async with db.scope():
+            await order_book.ensure_loaded()
+            outbox = notifier.Outbox()
+            await engines.order_pass({('GME', 0): 60.0}, outbox)
+            return outbox
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        outbox = asyncio.run(run())
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert len(deletes) == 1
+    assert [o.id for o in db.get_limit_orders(None)] == [kept] and list(order_book.orders) == [kept]
+    assert sorted(outbox.messages[5][:3]) == sorted('Issue with bob\'s order {id} it will be deleted.'.format(
+        id=order_id) for order_id in invalid)
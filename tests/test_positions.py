@@ -0,0 +1,33 @@
+from sqlalchemy import event
+
+from util import helpers
+
+
+def test_get_positions_loads_open_positions_in_one_query(db):
+    for discord_id in ['1', '2']:
+        db.initialize_new_user(discord_id)
+    helpers.transact_asset('1', 'bob', 'GME', '2', '10', 0, 0)
+    helpers.transact_asset('1', 'bob', 'AMC', '1', '5', 0, 0)
+    helpers.transact_asset('1', 'bob', 'AMC', '1', '6', 1, 0)
+    helpers.transact_asset('2', 'amy', 'btc', '0.5', '100', 0, 1)
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        positions = db.get_positions(['1', 2, '3'])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert len(statements) == 1
+    assert sorted(positions) == ['1', '2', '3']
+    assert [(p['name'], p['shares']) for p in positions['1']] == [('GME', 2.0), ('USDOLLAR', 49981.0)]
+    assert positions['2'][0] == {'name': 'BTC', 'shares': 0.5, 'current_value': 0, 'avg_price': 100.0,
+                                 'is_crypto': 1}
+    assert positions['3'] == []
+
+    assert sorted(db.get_positions()) == ['1', '2']
+    assert db.get_positions([]) == {}
+    assert db.get_all_assets(1) == positions['1']
@@ -0,0 +1,22 @@
+import time
+
+from util import price_board
+
+
+def test_price_board_round_trip():
+    board = price_board.PriceBoard.create(2)
+    reader = price_board.PriceBoard.attach(board.name)
+    try:
+        board.publish({('BTC', 1): 100.0, ('GME', 0): 10.0, ('AMC', 0): 5.0})
+        assert reader.read([('BTC', 1), ('GME', 0), ('AMC', 0)]) == {('BTC', 1): 100.0, ('GME', 0): 10.0}
+        board.publish({('GME', 0): 11.0}, updated=time.time() - 60)
+        assert reader.read([('BTC', 1), ('GME', 0)], max_age=30) == {('BTC', 1): 100.0}
+        assert reader.entries()[('GME', 0)][0] == 11.0
+
+        # A writer midway through a slot leaves its sequence number odd; readers skip the slot.
+        board.slots[0:1]['seq'] += 1
+        assert reader.read([('BTC', 1), ('GME', 0)]) == {('GME', 0): 11.0}
+    finally:
+        reader.close()
+        board.close()
+        board.unlink()
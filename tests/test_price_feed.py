@@ -0,0 +1,45 @@
+import asyncio
+
+from util import alerts, engines, notifier, order_book, price_feed, symbols
+
+
+def test_fake_feed_drives_the_stream_pass(db, monkeypatch):
+    monkeypatch.setattr(alerts, 'loaded', False)
+    monkeypatch.setattr(order_book, 'loaded', False)
+    monkeypatch.setattr(symbols, 'unknown', {})
+    db.initialize_new_user('1')
+    for is_less_than, price in [(1, 100), (1, 90), (0, 120)]:
+        db.create_alert(5, 'BTC', 1, is_less_than, price)
+    eth_alert = db.create_alert(5, 'ETH', 1, 0, 10)['id']
+    order = db.create_limit_order('1', 5, 'BTC', '0.5', 1, 0, 1, 90)['id']
+    # Would invalidate the ETH alert, were ETH evaluated without a price.
+    symbols.mark_unknown('ETH', 1)
+    outbox = notifier.Outbox()
+
+    async def on_stream_prices(prices):
+        async with db.scope():
+            await engines.stream_pass(prices, outbox)
+
+    async def run():
+        feed = price_feed.FakePriceFeed(covered=[('BTC', 1)])
+        feed.subscribe(on_stream_prices)
+        await feed.push({('BTC', 1): 95.0})
+        await feed.push({('BTC', 1): 85.0})
+        feed.start()
+        feed.put({('BTC', 1): 130.0})
+        for i in range(200):
+            if len(alerts.alerts) == 1:
+                break
+            await asyncio.sleep(0.01)
+        await feed.stop()
+        return feed
+
+    feed = asyncio.run(run())
+    assert feed.covers(('BTC', 1)) and not feed.covers(('ETH', 1))
+    assert list(alerts.alerts) == [eth_alert]
+    assert [a.id for a in db.get_all_alerts()] == [eth_alert]
+    assert order not in order_book.orders and db.get_limit_orders(None) == []
+    texts = outbox.messages[5]
+    assert [t.split('Current price: ')[1] for t in texts if t.startswith('```PRICE ALERT')] == \
+        ['95.0.```', '85.0.```', '130.0.```']
+    assert any(t.startswith('1 bought 0.5000 BTC at $85.00ea.') for t in texts)
@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from util import resilience
+
+
+def test_circuit_breaker_opens_and_lets_one_trial_through():
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    breaker.opened_at -= 31
+    assert breaker.state == 'half-open'
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    bucket = resilience.TokenBucket(rate=50, capacity=2)
+
+    async def acquire(n):
+        started = time.monotonic()
+        for i in range(n):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(acquire(2)) < 0.01
+    assert asyncio.run(acquire(2)) >= 0.03
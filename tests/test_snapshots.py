@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from util import helpers, snapshots
+
+
+def snapshot(discord_id, date, total):
+    return {'discord_id': discord_id, 'snapshot_date': date, 'total_value': total, 'cash': total,
+            'top_positions': ''}
+
+
+def test_take_snapshot_values_every_player_once(db, monkeypatch):
+    for discord_id in ['1', '2']:
+        db.initialize_new_user(discord_id)
+    helpers.transact_asset('1', 'bob', 'GME', '10', '10', 0, 0)
+    helpers.transact_asset('1', 'bob', 'AMC', '100', '5', 0, 0)
+    requested = []
+
+    async def get_prices(assets, failed=None, stale=None):
+        requested.append(sorted(assets))
+        return {('GME', 0): 15.0}
+
+    async def run():
+        await snapshots.take_snapshot()
+
+    monkeypatch.setattr(helpers, 'get_prices', get_prices)
+    asyncio.run(run())
+    assert requested == [[('AMC', 0), ('GME', 0)]]
+    run_date, totals = db.get_snapshot_run(latest=True)
+    assert totals == {'1': 50050.0, '2': 50000.0}
+    row = db.get_snapshots('1', run_date)[0]
+    assert row.cash == 49400.0 and row.top_positions == 'AMC:500.00,GME:150.00'
+
+
+def test_snapshot_runs_expiry_and_period_leaderboard(db):
+    now = datetime.utcnow().replace(microsecond=0)
+    db.initialize_new_user('1')
+    db.initialize_new_user('2')
+    db.set_display_name('1', 'bob')
+    rows = [snapshot('1', now - timedelta(days=db.SNAPSHOT_RETENTION_DAYS + 1), 1.0)]
+    for days, totals in [(2, (100.0, 100.0)), (1, (110.0, 100.0)), (0, (121.0, 50.0))]:
+        rows += [snapshot(str(u + 1), now - timedelta(days=days), total) for u, total in enumerate(totals)]
+    db.save_snapshots(rows)
+    db.expire_snapshots()
+    assert len(db.get_snapshots('1', datetime(2000, 1, 1))) == 3
+
+    assert db.get_snapshot_run(since=now - timedelta(hours=36)) == (now - timedelta(days=1), {'1': 110.0, '2': 100.0})
+    board = snapshots.format_period_leaderboard({1: 'member1', 2: 'member2', 3: 'member3'}, 'week', 7 * 86400)
+    assert board.split('\n')[1:3] == ['1. bob: $121.00 +$21.00 (+21.0%)', '2. member2: $50.00 -$50.00 (-50.0%)']
+    assert snapshots.format_period_leaderboard({}, 'hour', 3600).startswith('Not enough portfolio snapshots')
+
+    header, lines = snapshots.format_performance('1', 'bob', '3d', 3 * 86400)
+    assert header.startswith('bob over the last 3d: $100.00 to $121.00, +$21.00 (+21.0%)')
+    assert len(lines) == 3 + 3
@@ -0,0 +1,22 @@
+from util import symbols
+
+
+def test_lookup_leaves_unlisted_tickers_to_the_upstream(monkeypatch):
+    monkeypatch.setattr(symbols, 'stock_symbols', {'GME', 'BRK-B'})
+    monkeypatch.setattr(symbols, 'crypto_symbols', {'BTC'})
+    monkeypatch.setattr(symbols, 'known', set())
+    monkeypatch.setattr(symbols, 'unknown', {})
+    assert symbols.lookup('gme', 0) is True and symbols.lookup('BRK-B', 0) is True
+    # OTC and other symbols the Nasdaq directory does not list are still quoted upstream.
+    assert symbols.lookup('TCEHY', 0) is None and symbols.lookup('^GSPC', 0) is None
+    assert symbols.lookup('BTC', 1) is True and symbols.lookup('NOPE', 1) is False
+
+    symbols.mark_unknown('TCEHY', 0)
+    assert symbols.lookup('TCEHY', 0) is False
+    symbols.mark_known('TCEHY', 0)
+    assert symbols.lookup('TCEHY', 0) is True
+
+    symbols.mark_unknown('ZZZZ', 0)
+    symbols.unknown[('ZZZZ', 0)] -= symbols.SYMBOL_NEGATIVE_TTL + 1
+    assert symbols.lookup('ZZZZ', 0) is None
+    assert symbols.asset_class('btc') == 'crypto' and symbols.asset_class('TCEHY') == 'stock'
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from util import tick_history
+
+
+def test_tick_ring_keeps_the_newest_ticks_in_order():
+    ring = tick_history.TickRing(3)
+    for t in range(5):
+        ring.append(float(t), t * 10.0)
+    times, prices = ring.ordered()
+    assert times.tolist() == [2.0, 3.0, 4.0]
+    assert prices.tolist() == [20.0, 30.0, 40.0]
+    assert ring.ordered(2)[0].tolist() == [3.0, 4.0]
+    assert ring.last_time() == 4.0 and ring.unflushed == 5
+
+
+def test_tick_store_reads_across_segments_and_ring(tmp_path):
+    store = tick_history.TickStore(str(tmp_path), ring_size=10, segment_records=25)
+    for t in range(100):
+        store.record(('BTC', 1), float(t), 1000.0 + t)
+    times, prices = store.range(('BTC', 1), 1000.0, 1100.0)
+    assert np.array_equal(prices, np.arange(100.0))
+    assert store.ohlc(('BTC', 1), 1000.0, 1100.0, 50)[1] == (1050.0, 50.0, 99.0, 50.0, 99.0)
+
+
+def test_parse_period():
+    assert tick_history.parse_period('30m') == 1800
+    assert tick_history.parse_period('2W') == 14 * 86400
+    assert tick_history.parse_period('0d') is None
+    assert tick_history.parse_period('1y') is None
+    assert tick_history.parse_period('h') is None
+
+
+def test_tick_store_prunes_segments_past_the_retention(tmp_path):
+    store = tick_history.TickStore(str(tmp_path), ring_size=10, segment_records=10, retention=25)
+    for t in range(100):
+        store.record(('BTC', 1), float(t), 1000.0 + t)
+        if t % 10 == 9:
+            store.range(('BTC', 1), 1000.0, 1100.0)
+    store.flush_all()
+    files = sorted(os.listdir(tmp_path / 'BTC_c'))
+    assert [tick_history.segment_start(f) for f in files] == [1070.0, 1080.0, 1090.0]
+    assert store.segment_paths(('BTC', 1)) == [str(tmp_path / 'BTC_c' / f) for f in files]
+    assert store.maps == {}
+    times, prices = store.range(('BTC', 1), 1000.0, 1100.0)
+    assert times[0] == 1070.0 and prices[-1] == 99.0
@@ -0,0 +1,28 @@
+from util import helpers, valuation
+
+
+def test_value_positions_falls_back_to_cost_when_unpriced():
+    positions = {'1': [{'name': 'USDOLLAR', 'shares': 100.0, 'avg_price': 1.0, 'is_crypto': 0},
+                       {'name': 'GME', 'shares': 2.0, 'avg_price': 10.0, 'is_crypto': 0}],
+                 '2': [{'name': 'btc', 'shares': 0.5, 'avg_price': 100.0, 'is_crypto': 1}]}
+    values = valuation.value_positions(positions, {('GME', 0): 15.0}, {('BTC', 1): 200.0})
+    assert valuation.user_totals(values) == {'1': 130.0, '2': 100.0}
+    assert values['priced'].tolist() == [True, True, True]
+    assert values['pct_change'].tolist() == [0.0, 50.0, 100.0]
+
+    values = valuation.value_positions(positions, {})
+    assert values['priced'].tolist() == [True, False, False]
+    assert valuation.user_totals(values) == {'1': 120.0, '2': 50.0}
+
+
+def test_format_portfolio_marks_stale_and_unpriced_assets():
+    assets = [{'name': 'USDOLLAR', 'shares': 100.0, 'current_value': 100.0, 'avg_price': 1.0,
+               'current_unit_price': 1.0, 'pcnt_change': 0.0, 'is_priced': True, 'is_stale': False},
+              {'name': 'GME', 'shares': 2.0, 'current_value': 30.0, 'avg_price': 10.0,
+               'current_unit_price': 15.0, 'pcnt_change': 50.0, 'is_priced': True, 'is_stale': True},
+              {'name': 'XYZ', 'shares': 1.0, 'current_value': 5.0, 'avg_price': 5.0,
+               'current_unit_price': 5.0, 'pcnt_change': 0.0, 'is_priced': False, 'is_stale': False}]
+    page = helpers.format_portfolio((assets, 135.0))[0]
+    rows = page.split('\n')
+    assert '$15.00*' in rows[5] and '|n/a' in rows[6]
+    assert page.endswith('* Last known price, quotes are delayed.\nn/a: No price available, valued at average cost.')
@@ -0,0 +1,17 @@
+import queue
+
+from util import worker
+
+
+def test_apply_commands_updates_channels_and_names_until_stop():
+    commands = queue.Queue()
+    state = {'channels': None, 'names': {}}
+    commands.put(('channels', [5, 6]))
+    commands.put(('names', {'1': 'bob'}))
+    assert worker.apply_commands(commands, state)
+    commands.put(('channels', [5, 6, 7]))
+    commands.put(('names', {'2': 'amy'}))
+    commands.put(('stop',))
+    commands.put(('channels', []))
+    assert not worker.apply_commands(commands, state)
+    assert state == {'channels': {5, 6, 7}, 'names': {'1': 'bob', '2': 'amy'}}
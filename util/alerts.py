@@ -0,0 +1,88 @@
+import logging
+
+from util import database_connector, helpers, symbols
+from util.trigger_index import TriggerIndex
+
+# Active alerts, loaded from the database once and kept in sync by the alert commands.
+index = TriggerIndex()
+alerts = {}
+loaded = False
+# Set when the alert engine runs in a worker process: index changes are sent there instead of applied here.
+remote = None
+
+
+async def ensure_loaded():
+    global loaded
+    if loaded:
+        return
+    rows = await database_connector.run(database_connector.get_all_alerts)
+    if loaded:
+        return
+    index.clear()
+    alerts.clear()
+    for a in rows:
+        add_alert(a.id, a.channel_id, a.asset_code, a.is_crypto, a.is_less_than, a.price_per_unit)
+    loaded = True
+
+
+def add_alert(alert_id, channel_id, asset, is_crypto, is_less_than, price):
+    if remote is not None:
+        remote('add_alert', alert_id, channel_id, asset, is_crypto, is_less_than, price)
+        return
+    key = helpers.price_key(asset, is_crypto)
+    alerts[alert_id] = {'id': alert_id,
+                        'channel_id': int(channel_id),
+                        'asset_code': key[0],
+                        'is_crypto': key[1],
+                        'is_less_than': is_less_than,
+                        'price_per_unit': float(price)}
+    index.add(alert_id, key, is_less_than, price)
+
+
+def remove_alert(alert_id):
+    if remote is not None:
+        remote('remove_alert', alert_id)
+        return
+    alerts.pop(alert_id, None)
+    index.remove(alert_id)
+
+
+async def delete_alert(alert_id):
+    remove_alert(alert_id)
+    return await database_connector.run(database_connector.delete_alert, alert_id)
+
+
+# Deletes many alerts with one statement.
+async def delete_alerts(alert_ids):
+    alert_ids = list(alert_ids)
+    for alert_id in alert_ids:
+        remove_alert(alert_id)
+    if alert_ids:
+        return await database_connector.run(database_connector.delete_alerts, alert_ids)
+
+
+def price_keys():
+    return index.keys()
+
+
+# Matches one round of prices against the index. Returns the alerts that fired (with the price that fired them)
+# and the alerts whose asset the upstream does not know. Assets in failed are skipped until the next round.
+# keys limits the pass to some assets, e.g. the ones that just ticked on a price stream.
+def evaluate(prices, failed=(), keys=None):
+    fired = []
+    invalid = []
+    for key in price_keys() if keys is None else price_keys() & set(keys):
+        if key in failed:
+            logging.error('Skipping alerts for {asset}: price unavailable.'.format(asset=key[0]))
+            continue
+        current_price = prices.get(key)
+        if current_price is None:
+            # Only a symbol confirmed unknown invalidates its alerts; anything else may be a transient gap.
+            if symbols.lookup(*key) is False:
+                invalid.extend(alerts[alert_id] for alert_id in index.ids_for(key))
+            else:
+                logging.error('Skipping alerts for {asset}: no price returned.'.format(asset=key[0]))
+            continue
+        for alert_id in index.triggered(key, current_price):
+            fired.append(dict(alerts[alert_id], current_price=current_price))
+    return fired, invalid
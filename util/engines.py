@@ -0,0 +1,71 @@
+import logging
+
+from util import alerts, database_connector, helpers, order_book
+
+
+# One alert pass over a round of prices: fired and invalid alerts are deleted and their notifications queued on
+# outbox. is_visible(channel_id) limits the pass to channels this bot can post in.
+async def alert_pass(prices, outbox, failed=(), keys=None, is_visible=None):
+    fired, invalid = alerts.evaluate(prices, failed, keys)
+    if is_visible is not None:
+        fired = [a for a in fired if is_visible(a['channel_id'])]
+        invalid = [a for a in invalid if is_visible(a['channel_id'])]
+    # delete_alerts takes them out of the index before its first await, so an overlapping pass cannot fire them
+    # again.
+    await alerts.delete_alerts(a['id'] for a in fired + invalid)
+
+    for a in invalid:
+        logging.error('Error with alert {id}: no price for {asset}'.format(id=a['id'], asset=a['asset_code']))
+        outbox.add(a['channel_id'], 'Issue with alert ' + str(a['id']) + ' it will be deleted.')
+    for channel_id in {a['channel_id'] for a in invalid}:
+        outbox.add(channel_id, await database_connector.run(helpers.format_alerts, channel_id))
+
+    for a in fired:
+        outbox.add(a['channel_id'],
+                   '```PRICE ALERT: {asset} {above_below} {alert_price}! Current price: {current_price}.```'.format(
+                       asset=a['asset_code'],
+                       above_below='below' if a['is_less_than'] else 'above',
+                       alert_price=str(round(a['price_per_unit'], 2)),
+                       current_price=str(round(float(a['current_price']), 2))))
+
+
+# One limit order pass: triggered orders are filled, invalid ones deleted, and the results queued on outbox.
+# member_name(discord_id) names users who never ran !setname.
+async def order_pass(prices, outbox, failed=(), keys=None, is_visible=None, member_name=None):
+    triggered, invalid = order_book.match(prices, failed, keys)
+    if is_visible is not None:
+        triggered = [o for o in triggered if is_visible(o['channel_id'])]
+        invalid = [o for o in invalid if is_visible(o['channel_id'])]
+    if not triggered and not invalid:
+        return
+    # Taken out of the book before the first await so an overlapping pass cannot fill them again.
+    for o in triggered + invalid:
+        order_book.remove_order(o['id'], o['discord_id'])
+
+    display_names = await database_connector.run(database_connector.get_display_names,
+                                                 {o['discord_id'] for o in triggered + invalid})
+    for o in triggered + invalid:
+        if display_names.get(o['discord_id']) is None:
+            name = member_name(o['discord_id']) if member_name is not None else None
+            display_names[o['discord_id']] = name if name is not None else o['discord_id']
+    fills = await order_book.fill(triggered, display_names)
+    await order_book.delete_orders(invalid)
+
+    for o in invalid:
+        display_name = display_names[o['discord_id']]
+        logging.error('Error with order {id}: no price for {asset}'.format(id=o['id'], asset=o['asset_code']))
+        outbox.add(o['channel_id'], 'Issue with ' + display_name + '\'s order ' + str(o['id']) + ' it will be deleted.')
+    for channel_id, discord_id in {(o['channel_id'], o['discord_id']) for o in invalid}:
+        outbox.add(channel_id, await database_connector.run(helpers.format_limit_orders, discord_id))
+
+    for o, message in fills:
+        outbox.add(o['channel_id'], message)
+
+
+# The passes for one update of a price stream: only the assets that ticked are evaluated, so alerts and orders on
+# assets the stream does not carry are left to the polling loops.
+async def stream_pass(prices, outbox, is_visible=None, member_name=None):
+    await alerts.ensure_loaded()
+    await order_book.ensure_loaded()
+    await alert_pass(prices, outbox, keys=prices.keys(), is_visible=is_visible)
+    await order_pass(prices, outbox, keys=prices.keys(), is_visible=is_visible, member_name=member_name)
@@ -1,10 +1,14 @@
 from datetime import datetime, timezone, timedelta
 
+import asyncio
+import collections
+import csv
 import logging
-import requests
-from yahoo_fin import stock_info as si
+import os
+import tempfile
+import time
 
-from util import database_connector
+from util import database_connector, price_client, symbols, tick_history, valuation
 from decimal import *
 
 logging.basicConfig(filename='stock_bot_log.log', level=logging.INFO)
@@ -12,13 +16,79 @@ getcontext().prec = 30
 getcontext().rounding = ROUND_DOWN
 
 
-def get_crypto_price_data(code):
-    crypto_price_url = 'https://www.binance.com/gateway-api/v2/public/asset-service/product/get-products?includeEtf=false'
+CRYPTO_PRODUCTS_URL = os.getenv('CRYPTO_PRODUCTS_URL', 'https://www.binance.com/gateway-api/v2/public/asset-service'
+                                                       '/product/get-products?includeEtf=false')
+CRYPTO_PRODUCTS_TTL = float(os.getenv('CRYPTO_PRODUCTS_TTL', '10'))
+# Quote assets accepted as USD, most preferred first.
+USD_QUOTE_PREFERENCE = ['USDT', 'BUSD', 'USDC', 'USD', 'TUSD', 'USDP']
 
-    response = requests.get(crypto_price_url)
-    data = response.json()['data']
-    asset_info = next((a for a in data if (a['b'].lower() == code.lower() and 'usd' in a['q'].lower())), None)
+crypto_usd_products = {}
+crypto_products_updated = 0.0
+crypto_products_refresh = None
 
+
+def usd_quote_rank(quote):
+    quote = quote.upper()
+    if quote in USD_QUOTE_PREFERENCE:
+        return USD_QUOTE_PREFERENCE.index(quote)
+    return len(USD_QUOTE_PREFERENCE) if 'USD' in quote else None
+
+
+def load_crypto_products(data):
+    global crypto_usd_products, crypto_products_updated
+    usd_products = {}
+    for a in data:
+        base = a['b'].upper()
+        rank = usd_quote_rank(a['q'])
+        if rank is None:
+            continue
+        current = usd_products.get(base)
+        if current is None or rank < usd_quote_rank(current['q']):
+            usd_products[base] = a
+    crypto_usd_products = usd_products
+    crypto_products_updated = time.monotonic()
+    symbols.set_crypto_symbols(usd_products)
+
+
+async def fetch_crypto_products():
+    global crypto_products_refresh
+    try:
+        response_data = await price_client.get_json(CRYPTO_PRODUCTS_URL, provider='binance')
+        load_crypto_products(response_data['data'])
+    finally:
+        crypto_products_refresh = None
+
+
+# Concurrent refreshes join the download already in flight instead of starting their own. The download is
+# shielded so a caller that gives up does not cancel it for everyone else.
+async def refresh_crypto_products(force=False):
+    global crypto_products_refresh
+    if crypto_products_refresh is None:
+        if not force and crypto_usd_products and time.monotonic() - crypto_products_updated < CRYPTO_PRODUCTS_TTL:
+            return
+        crypto_products_refresh = asyncio.ensure_future(fetch_crypto_products())
+    await asyncio.shield(crypto_products_refresh)
+
+
+# While Binance is unreachable the last snapshot is served, flagged as stale.
+async def get_crypto_product(code):
+    is_stale = False
+    try:
+        await refresh_crypto_products()
+    except Exception as e:
+        if not crypto_usd_products:
+            raise
+        logging.error('Serving stale crypto products: ' + repr(e))
+        is_stale = True
+    asset_info = crypto_usd_products.get(code.upper())
+    if asset_info is None:
+        raise KeyError('No USD market for ' + code.upper())
+    if not is_stale:
+        tick_history.record({(code.upper(), 1): float(asset_info['c'])})
+    return asset_info, is_stale
+
+
+def format_crypto_product(asset_info, is_stale=False):
     crypto_name = asset_info['an']
     current_price = float(asset_info['c'])
     previous_close_24_hr = float(asset_info['o'])
@@ -28,13 +98,82 @@ def get_crypto_price_data(code):
     return {'name': crypto_name,
             'current_price': str(current_price),
             'daily_change_amt': str(round(daily_change_amt, 2)),
-            'daily_change_percent': str(daily_change_percent)}
+            'daily_change_percent': str(daily_change_percent),
+            'is_stale': is_stale}
+
+
+async def get_crypto_price_data(code):
+    return format_crypto_product(*await get_crypto_product(code))
+
 
+STOCK_QUOTE_URL = os.getenv('STOCK_QUOTE_URL', 'https://query1.finance.yahoo.com/v7/finance/quote')
+STOCK_QUOTE_CHUNK_SIZE = int(os.getenv('STOCK_QUOTE_CHUNK_SIZE', '50'))
+# Seconds a fetched quote is reused for later requests. 0 only shares fetches that are still in flight.
+STOCK_QUOTE_FRESHNESS = float(os.getenv('STOCK_QUOTE_FRESHNESS', '0'))
 
-def get_stock_price_data(code):
+stock_quote_fetches = {}
+stock_quote_cache = {}
+
+
+async def fetch_stock_chunk(chunk):
+    try:
+        response_data = await price_client.get_json(STOCK_QUOTE_URL, params={'symbols': ','.join(chunk)},
+                                                     provider='yahoo')
+        quotes = {daily_data['symbol'].upper(): daily_data for daily_data in response_data['quoteResponse']['result']}
+        fetched = time.monotonic()
+        for code in chunk:
+            if code in quotes:
+                symbols.mark_known(code, 0)
+                stock_quote_cache[code] = (fetched, quotes[code])
+            else:
+                symbols.mark_unknown(code, 0)
+                stock_quote_cache.pop(code, None)
+        return quotes
+    finally:
+        for code in chunk:
+            if stock_quote_fetches.get(code) is asyncio.current_task():
+                del stock_quote_fetches[code]
+
+
+# Tickers already being fetched by another caller join that request, and quotes younger than
+# STOCK_QUOTE_FRESHNESS are served from memory, so a burst of requests for one ticker costs one upstream call.
+# With a failed set, chunks whose request errors are recorded there instead of failing the whole batch.
+async def get_stock_quotes(codes, failed=None):
+    codes = sorted({code.upper() for code in codes})
+    now = time.monotonic()
+    quotes = {}
+    fetches = {}
+    missing = []
+    for code in codes:
+        cached = stock_quote_cache.get(code)
+        if cached is not None and now - cached[0] < STOCK_QUOTE_FRESHNESS:
+            quotes[code] = cached[1]
+        elif code in stock_quote_fetches:
+            fetches[code] = stock_quote_fetches[code]
+        else:
+            missing.append(code)
+    for i in range(0, len(missing), STOCK_QUOTE_CHUNK_SIZE):
+        chunk = missing[i:i + STOCK_QUOTE_CHUNK_SIZE]
+        task = asyncio.ensure_future(fetch_stock_chunk(chunk))
+        for code in chunk:
+            stock_quote_fetches[code] = fetches[code] = task
+
+    tasks = list(set(fetches.values()))
+    results = await asyncio.gather(*[asyncio.shield(task) for task in tasks], return_exceptions=failed is not None)
+    results = dict(zip(tasks, results))
+    for code, task in fetches.items():
+        response = results[task]
+        if isinstance(response, Exception):
+            logging.error('Error fetching quote for ' + code + ': ' + str(response))
+            failed.add(code)
+        elif code in response:
+            quotes[code] = response[code]
+    return quotes
+
+
+def format_stock_quote(daily_data, is_stale=False):
     date = datetime.now(timezone.utc)
     day_of_week = date.weekday()
-    daily_data = si.get_quote_data(code)
     try:
         stock_name = daily_data['longName']
     except KeyError:
@@ -56,15 +195,117 @@ def get_stock_price_data(code):
     return {'name': stock_name,
             'current_price': str(current_price),
             'daily_change_amt': str(daily_change_amt),
-            'daily_change_percent': str(daily_change_percent)}
-
-
-def get_price_of_asset(code, is_crypto):
-    return float(get_crypto_price_data(code)['current_price']) if is_crypto == 1 \
-        else float(get_stock_price_data(code)['current_price'])
-
-
-def get_wsb_hits(code):
+            'daily_change_percent': str(daily_change_percent),
+            'is_stale': is_stale}
+
+
+async def get_stock_prices(codes, failed=None):
+    quotes = await get_stock_quotes(codes, failed)
+    return {code: format_stock_quote(daily_data) for code, daily_data in quotes.items()}
+
+
+# While Yahoo is unreachable the last quote fetched for the ticker is served, flagged as stale.
+async def get_stock_price_data(code):
+    code = code.upper()
+    failed = set()
+    quotes = await get_stock_quotes([code], failed)
+    if code in failed and code in stock_quote_cache:
+        return format_stock_quote(stock_quote_cache[code][1], is_stale=True)
+    if code in failed:
+        raise LookupError('Quote unavailable for ' + code)
+    price_data = format_stock_quote(quotes[code])
+    tick_history.record({(code, 0): float(price_data['current_price'])})
+    return price_data
+
+
+async def get_price_of_asset(code, is_crypto):
+    price_data = await get_crypto_price_data(code) if is_crypto == 1 else await get_stock_price_data(code)
+    return float(price_data['current_price'])
+
+
+def price_key(code, is_crypto):
+    return code.upper(), 1 if is_crypto else 0
+
+
+# Set in the bot process when a worker publishes prices to a shared board (see util.worker). Board prices younger
+# than PRICE_BOARD_MAX_AGE seconds are used without a network call.
+price_board = None
+PRICE_BOARD_MAX_AGE = float(os.getenv('PRICE_BOARD_MAX_AGE', '30'))
+# Prices recorded in the tick history within the last TICK_MAX_AGE seconds are used without a network call.
+# 0 always fetches.
+TICK_MAX_AGE = float(os.getenv('TICK_MAX_AGE', '0'))
+
+
+# The last good price fetched for an asset: the previous product snapshot for crypto, the last quote for stocks.
+def last_known_price(key):
+    code, is_crypto = key
+    if is_crypto:
+        asset_info = crypto_usd_products.get(code)
+        return float(asset_info['c']) if asset_info is not None else None
+    cached = stock_quote_cache.get(code)
+    return float(format_stock_quote(cached[1])['current_price']) if cached is not None else None
+
+
+# Prices many (code, is_crypto) pairs with one upstream request per chunk of stocks.
+# Assets the upstream does not know are left out of the result. When a failed set is given, upstream errors
+# are isolated: the price_keys that could not be fetched are added to it and everything else is still priced.
+# When a stale set is given as well, failed assets are priced at their last known good price and moved from
+# failed to stale.
+async def get_prices(assets, failed=None, stale=None):
+    assets = {price_key(code, is_crypto) for code, is_crypto in assets}
+    prices = {}
+    if price_board is not None:
+        prices = price_board.read(assets, PRICE_BOARD_MAX_AGE)
+        assets.difference_update(prices)
+    if TICK_MAX_AGE > 0:
+        prices.update(tick_history.history.latest(assets, TICK_MAX_AGE))
+        assets.difference_update(prices)
+    stock_codes = [code for code, is_crypto in assets if not is_crypto]
+    crypto_codes = [code for code, is_crypto in assets if is_crypto]
+    failed_stocks = set() if failed is not None else None
+    stock_prices, crypto_result = await asyncio.gather(
+        get_stock_prices(stock_codes, failed_stocks),
+        refresh_crypto_products() if crypto_codes else asyncio.sleep(0),
+        return_exceptions=failed is not None)
+    if isinstance(stock_prices, Exception):
+        logging.error('Error fetching stock quotes: ' + str(stock_prices))
+        failed.update((code, 0) for code in stock_codes)
+        stock_prices = {}
+    if isinstance(crypto_result, Exception):
+        logging.error('Error refreshing crypto products: ' + str(crypto_result))
+        failed.update((code, 1) for code in crypto_codes)
+        crypto_codes = []
+    if failed_stocks:
+        failed.update((code, 0) for code in failed_stocks)
+
+    for code, price_data in stock_prices.items():
+        prices[(code, 0)] = float(price_data['current_price'])
+    for code in crypto_codes:
+        asset_info = crypto_usd_products.get(code)
+        if asset_info is not None:
+            prices[(code, 1)] = float(asset_info['c'])
+    tick_history.record({key: price for key, price in prices.items() if key in assets})
+    if stale is not None:
+        for key in list(failed):
+            last_price = last_known_price(key)
+            if last_price is not None:
+                prices[key] = last_price
+                failed.discard(key)
+                stale.add(key)
+    return prices
+
+
+WSB_CACHE_TTL = float(os.getenv('WSB_CACHE_TTL', '900'))
+WSB_TIME_BUDGET = float(os.getenv('WSB_TIME_BUDGET', '1.5'))
+WSB_REQUEST_TIMEOUT = float(os.getenv('WSB_REQUEST_TIMEOUT', '10'))
+WSB_REFRESH_COUNT = int(os.getenv('WSB_REFRESH_COUNT', '20'))
+
+wsb_cache = {}
+wsb_fetches = {}
+wsb_requests = collections.Counter()
+
+
+async def fetch_wsb_hits(code):
     date = datetime.now(timezone.utc)
     today = str(int(date.timestamp()))
     one_day_ago = str(int((date - timedelta(days=1)).timestamp()))
@@ -76,15 +317,51 @@ def get_wsb_hits(code):
 
     try:
         formatted_url = (url % {'code': code, 'today': today, 'one_day_ago': one_day_ago})
-        response_data = requests.get(formatted_url, headers={'referer': 'https://redditsearch.io/',
-                                                             'origin': 'https://redditsearch.io'}).json()
+        response_data = await price_client.get_json(formatted_url, headers={'referer': 'https://redditsearch.io/',
+                                                                             'origin': 'https://redditsearch.io'},
+                                                    timeout=WSB_REQUEST_TIMEOUT, provider='pushshift')
         hits = response_data['hits']['total']
-    except Exception:
-        hits = 0
-    if hits > 0:
-        return ' {hits} hits on r/wallstreetbets in the last 24 hours'.format(hits=hits)
-    else:
+    except Exception as e:
+        logging.info('WSB search failed for ' + code + ': ' + repr(e))
         return ''
+    wsb_info = ' {hits} hits on r/wallstreetbets in the last 24 hours'.format(hits=hits) if hits > 0 else ''
+    wsb_cache[code] = (time.monotonic() + WSB_CACHE_TTL, wsb_info)
+    return wsb_info
+
+
+def start_wsb_fetch(code):
+    task = wsb_fetches.get(code)
+    if task is None or task.done():
+        task = wsb_fetches[code] = asyncio.ensure_future(fetch_wsb_hits(code))
+    return task
+
+
+# Cached WSB mention count for a ticker. With a budget (seconds), gives up waiting after that long and returns
+# the stale count, or nothing; the search keeps running in the background and fills the cache for next time.
+async def get_wsb_hits(code, budget=None):
+    code = code.upper()
+    wsb_requests[code] += 1
+    cached = wsb_cache.get(code)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    task = start_wsb_fetch(code)
+    if budget is None:
+        return await task
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), budget)
+    except asyncio.TimeoutError:
+        return cached[1] if cached is not None else ''
+
+
+# Re-fetches the most requested tickers so their counts stay warm, then halves the request counts so the
+# ranking follows recent demand.
+async def refresh_wsb_hits():
+    codes = [code for code, count in wsb_requests.most_common(WSB_REFRESH_COUNT)]
+    await asyncio.gather(*[start_wsb_fetch(code) for code in codes])
+    for code in list(wsb_requests):
+        wsb_requests[code] //= 2
+        if wsb_requests[code] == 0:
+            del wsb_requests[code]
 
 
 def transact_asset(discord_id, discord_name, asset, amount, price, is_sale, is_crypto):
@@ -149,22 +426,64 @@ def transact_asset(discord_id, discord_name, asset, amount, price, is_sale, is_c
                 cost=amount)
 
 
-def check_balance(discord_id):
-    assets = database_connector.get_all_assets(discord_id)
+# Runs a batch of trades (see database_connector.make_transactions) and returns a summary line and one table row
+# per executed leg.
+def transact_assets(discord_id, discord_name, legs):
+    result = database_connector.make_transactions(discord_id, legs)
+    if not result.get('is_successful'):
+        if result.get('message') == 'Insufficient Funds':
+            return 'Sorry {discord_name}, you\'re too poor to buy {asset}. Nothing was traded. Available Balance: ' \
+                   '${available_bal} Transaction Cost: ${cost}'.format(
+                discord_name=discord_name,
+                asset=result.get('asset'),
+                available_bal=round(result.get('available_funds'), 3),
+                cost=round(result.get('transaction_cost'), 3)), []
+        elif result.get('message') == 'Insufficient Shares':
+            return 'Sorry {discord_name}, you don\'t own enough {asset}. Nothing was traded. Available {asset}: ' \
+                   '{available_bal} Amount Requested: {cost}'.format(
+                discord_name=discord_name,
+                asset=result.get('asset'),
+                available_bal=result.get('available_funds'),
+                cost=round(result.get('requested'), 4)), []
+        elif result.get('message') == 'Nothing To Trade':
+            return 'Nothing to trade, {discord_name}.'.format(discord_name=discord_name), []
+        return 'Sorry {discord_name}, the trades failed. Nothing was traded.'.format(discord_name=discord_name), []
+
+    fills = result['fills']
+    rows = ['{action:<5}{asset:<10}{volume:>16}{price:>14}{total:>16}{pl:>16}'.format(
+        action='Side', asset='Asset', volume='Volume', price='Price', total='Total', pl='P/L')]
+    for f in fills:
+        rows.append('{action:<5}{asset:<10}{volume:>16}{price:>14}{total:>16}{pl:>16}'.format(
+            action='Sell' if f['is_sale'] else 'Buy',
+            asset=f['asset'],
+            volume=str(round(f['volume'], 4)),
+            price='${:,.2f}'.format(f['price_per_unit']),
+            total='${:,.2f}'.format(f['total']),
+            pl=('+' if f['profit_loss'] >= 0 else '-') + '${:,.2f}'.format(abs(f['profit_loss']))))
+    sold = sum(f['total'] for f in fills if f['is_sale'])
+    bought = sum(f['total'] for f in fills if not f['is_sale'])
+    summary = '{discord_name} made {count} trades: sold ${sold}, bought ${bought}. USD Balance = ${new_bal}.'.format(
+        discord_name=discord_name,
+        count=len(fills),
+        sold='{:,.2f}'.format(sold),
+        bought='{:,.2f}'.format(bought),
+        new_bal='{:,.2f}'.format(result['available_funds']))
+    return summary, rows
+
+
+# Assets whose price cannot be fetched are shown at their last known price, flagged as stale, or, failing that,
+# valued at average cost and flagged as unpriced.
+async def check_balance(discord_id):
+    assets = await database_connector.run(database_connector.get_all_assets, discord_id)
+    stale = set()
+    prices = await get_prices(((a['name'], a['is_crypto']) for a in assets if a['name'] != 'USDOLLAR'),
+                              failed=set(), stale=stale)
+    positions = {discord_id: assets}
+    values = valuation.value_positions(positions, prices)
+    valuation.annotate(positions, values)
     for asset in assets:
-        if asset['name'] == 'USDOLLAR':
-            asset['current_value'] = asset['shares']
-            asset['current_unit_price'] = asset['avg_price']
-        else:
-            asset['current_unit_price'] = get_price_of_asset(asset['name'], asset['is_crypto'])
-            asset['current_value'] = asset['current_unit_price'] * asset['shares']
-    total = sum(asset['current_value'] for asset in assets)
-
-    return assets, total
-
-
-def get_pcnt_change(val1, val2):
-    return (val1 - val2) / val2 * 100
+        asset['is_stale'] = price_key(asset['name'], asset['is_crypto']) in stale
+    return assets, float(values['totals'].sum())
 
 
 def format_portfolio(assets_info):
@@ -174,47 +493,101 @@ def format_portfolio(assets_info):
     p_string += '|Asset'.ljust(11) + '|Volume'.ljust(15) + '|Value'.ljust(15) + '|Average Cost'.ljust(16) + \
                 '|Current Cost'.ljust(14) + '|% Change|'
     p_string += '\n|----------|--------------|--------------|---------------|-------------|--------|'
+    has_stale = has_unpriced = False
 
     for asset in assets:
         decimals = 3 if asset['avg_price'] < 10 and asset['name'].upper() != 'USDOLLAR' else 2
         if asset['name'].upper() == 'USDOLLAR' and asset['shares'] < .0000001:
             continue
-        p_string += '\n|{asset}|{volume}|${value}|${avg_price}|${current_price}|{pcnt_chg}|'.format(
+        if not asset['is_priced']:
+            has_unpriced = True
+            current_price = 'n/a'
+            pcnt_chg = 'n/a'
+        else:
+            has_stale = has_stale or asset['is_stale']
+            current_price = '$' + '{:,.{decimals}f}'.format(asset['current_unit_price'], decimals=decimals) + \
+                            ('*' if asset['is_stale'] else '')
+            pcnt_chg = str(round(asset['pcnt_change'], 2)) + '%'
+        p_string += '\n|{asset}|{volume}|${value}|${avg_price}|{current_price}|{pcnt_chg}|'.format(
             asset=asset['name'].upper().ljust(10),
             volume=str(round(asset['shares'], 4)).ljust(14),
             value='{:,.2f}'.format(asset['current_value']).ljust(13),
             avg_price='{:,.{decimals}f}'.format(asset['avg_price'], decimals=decimals).ljust(14),
-            current_price='{:,.{decimals}f}'.format(asset['current_unit_price'], decimals=decimals).ljust(12),
-            pcnt_chg=str(str(round(get_pcnt_change(asset['current_unit_price'], asset['avg_price']), 2)) + '%').ljust(
-                8))
+            current_price=current_price.ljust(13),
+            pcnt_chg=pcnt_chg.ljust(8))
         if len(p_string) > 1750:
             pages.append(p_string)
             p_string = '|Asset'.ljust(11) + '|Volume'.ljust(15) + '|Value'.ljust(15) + '|Average Cost'.ljust(16) + \
                        '|Current Cost'.ljust(14) + '|% Change|'
             p_string += '\n|----------|--------------|--------------|---------------|-------------|--------|'
+    if has_stale or has_unpriced:
+        p_string += '\n'
+    if has_stale:
+        p_string += '\n* Last known price, quotes are delayed.'
+    if has_unpriced:
+        p_string += '\nn/a: No price available, valued at average cost.'
     pages.append(p_string)
     return pages
 
 
-def format_leaderboard(server_members):
-    users = database_connector.get_all_users()
-    user_totals = []
-    for index, user in enumerate(users[0]):
-        if int(user) in server_members.keys():
-            name = server_members[int(user)] if users[1][index] is None else users[1][index]
-            user_totals.append({'name': name, 'total': check_balance(user)[1]})
-
-    lb_string = ''
-    for index, user in enumerate(sorted(user_totals, key=lambda i: i['total'], reverse=True)):
-        lb_string += '{place}. {name}: ${total}\n'.format(place=index + 1,
-                                                          name=user['name'],
-                                                          total='{:,.2f}'.format(user['total']))
-    return lb_string
-
-
-def format_transaction_history(discord_id):
-    transactions = database_connector.get_transaction_history(discord_id)
-    transactions_string = 'Recent Transactions:'
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '10'))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# discord_id -> {page number: id of the last transaction on the page before it}, filled in as pages are visited
+# and dropped when the user trades, since new rows shift every page.
+history_pages = {}
+
+
+def forget_history_pages(discord_id):
+    history_pages.pop(str(discord_id), None)
+
+
+database_connector.trade_listeners.append(forget_history_pages)
+
+
+# The transaction page `page` starts after, walking the index forward from the nearest page already visited.
+# Returns (False, None) if the ledger ends before that page.
+def history_page_start(discord_id, page):
+    pages = history_pages.setdefault(str(discord_id), {1: None})
+    known = max(p for p in pages if p <= page)
+    if known < page:
+        # One id past the skipped pages, so a ledger ending exactly on a page boundary has no next page.
+        skipped = (page - known) * HISTORY_PAGE_SIZE
+        ids = database_connector.get_transaction_ids(discord_id, pages[known], skipped + 1)
+        if len(ids) <= skipped:
+            return False, None
+        for p in range(known + 1, page + 1):
+            pages[p] = ids[(p - known) * HISTORY_PAGE_SIZE - 1]
+    return True, pages[page]
+
+
+# One page of the user's ledger, newest first. position is a page number or an '@<id>' cursor from a previous
+# page's footer; cursors keep working while page numbers shift as the user trades.
+def format_transaction_history(discord_id, position=None):
+    page = None
+    if position is None:
+        page, before = 1, None
+    elif position.startswith('@') and position[1:].isdigit():
+        before = int(position[1:])
+        if not database_connector.is_own_transaction(discord_id, before):
+            return 'Unknown history cursor ' + position + '.'
+    elif position.isdigit() and int(position) > 0:
+        page = int(position)
+        found, before = history_page_start(discord_id, page)
+        if not found:
+            return 'You have no transactions on page {page}.'.format(page=page)
+    else:
+        return 'Use !history [page] or !history @[cursor].'
+
+    transactions = database_connector.get_transaction_history(discord_id, before, HISTORY_PAGE_SIZE + 1)
+    has_more = len(transactions) > HISTORY_PAGE_SIZE
+    transactions = transactions[:HISTORY_PAGE_SIZE]
+    if page == 1:
+        transactions_string = 'Recent Transactions:'
+    elif page is not None:
+        transactions_string = 'Transactions (Page {page}):'.format(page=page)
+    else:
+        transactions_string = 'Transactions before {position}:'.format(position=position)
     for t in transactions:
         action = 'Sold' if t.is_sale == 1 else 'Bought'
         total = t.volume * t.price_per_unit
@@ -225,21 +598,47 @@ def format_transaction_history(discord_id):
             asset=t.asset_code.upper(),
             cost_per_unit=round(t.price_per_unit, 3),
             total=round(total, 3))
+    if has_more:
+        last = transactions[-1]
+        if page is not None:
+            history_pages.setdefault(str(discord_id), {1: None})[page + 1] = last.id
+            transactions_string += '\n\nOlder: !history {page} or !history @{id}'.format(page=page + 1, id=last.id)
+        else:
+            transactions_string += '\n\nOlder: !history @{id}'.format(id=last.id)
     return transactions_string
 
 
+# Writes the user's whole ledger as CSV to a temporary file, streaming it from the database in batches so memory
+# stays bounded. Returns the file's path and the number of transactions; the caller removes the file.
+def export_transactions(discord_id):
+    count = 0
+    export = tempfile.NamedTemporaryFile('w', newline='', suffix='.csv', delete=False)
+    try:
+        with export:
+            writer = csv.writer(export)
+            writer.writerow(['id', 'date', 'action', 'asset', 'asset_class', 'volume', 'price_per_unit', 'total'])
+            for t in database_connector.iter_transactions(discord_id, EXPORT_BATCH_SIZE):
+                writer.writerow([t.id, t.transaction_date, 'sell' if t.is_sale == 1 else 'buy', t.asset_code.upper(),
+                                 'crypto' if t.is_crypto else 'stock', t.volume, t.price_per_unit,
+                                 t.volume * t.price_per_unit])
+                count += 1
+    except Exception:
+        os.remove(export.name)
+        raise
+    return export.name, count
+
+
 def format_alerts(channel_id):
-    alerts = database_connector.get_all_alerts()
+    alerts = database_connector.get_alerts(channel_id)
     alerts_string = 'Active Alerts:'
     if len(alerts) == 0:
         return 'No Active Alerts for this Channel.'
     for a in alerts:
-        if int(a.channel_id) == int(channel_id):
-            a_b_str = '<' if a.is_less_than else '>'
-            alerts_string += '\n[{id}] {asset} {above_below} {price}'.format(id=a.id,
-                                                                             asset=a.asset_code.upper(),
-                                                                             above_below=a_b_str,
-                                                                             price=round(a.price_per_unit, 2))
+        a_b_str = '<' if a.is_less_than else '>'
+        alerts_string += '\n[{id}] {asset} {above_below} {price}'.format(id=a.id,
+                                                                         asset=a.asset_code.upper(),
+                                                                         above_below=a_b_str,
+                                                                         price=round(a.price_per_unit, 2))
     return '```' + alerts_string + '```'
 
 
@@ -262,3 +661,60 @@ def format_limit_orders(discord_id):
                 buy_sell=b_s_str)
 
     return '```' + orders_string + '```'
+
+
+CHART_BUCKETS = int(os.getenv('CHART_BUCKETS', '12'))
+SPARK_LEVELS = '▁▂▃▄▅▆▇█'
+
+
+def format_tick_price(price, reference=None):
+    reference = price if reference is None else reference
+    return '{:,.{decimals}f}'.format(price, decimals=3 if reference < 10 else 2)
+
+
+def format_tick_time(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%m-%d %H:%M')
+
+
+# How far an asset moved over the last `seconds` of its tick history. When the history does not reach that far
+# back the change since the first recorded tick is shown instead.
+def format_price_change(key, period, seconds, current_price):
+    now = time.time()
+    past_price = tick_history.history.price_at(key, now - seconds)
+    since = 'the last ' + period
+    if past_price is None:
+        times, prices = tick_history.history.range(key, now - seconds, now)
+        if len(times) < 2:
+            return 'No price history for {code} yet, try again later.'.format(code=key[0])
+        past_price = float(prices[0])
+        since = format_tick_time(times[0]) + ' UTC'
+    change_amt = current_price - past_price
+    return '{code}: ${current_price} ({sign}${change_amt}, {sign}{change_percent}%) over {since}.'.format(
+        code=key[0],
+        current_price=format_tick_price(current_price),
+        sign='+' if change_amt >= 0 else '-',
+        change_amt=format_tick_price(abs(change_amt), current_price),
+        change_percent=str(round(abs(change_amt) / past_price * 100, 2)) if past_price else '0.0',
+        since=since)
+
+
+# (header, rows) charting an asset over the last `seconds` as a sparkline of closes and one OHLC row per bucket,
+# None if there is no history for the period.
+def format_chart(key, period, seconds):
+    now = time.time()
+    bucket = max(1, seconds // CHART_BUCKETS)
+    candles = tick_history.history.ohlc(key, now - seconds, now + 1, bucket)
+    if not candles:
+        return None
+    low = min(c[3] for c in candles)
+    high = max(c[2] for c in candles)
+    spark = ''.join(SPARK_LEVELS[int((c[4] - low) / (high - low) * (len(SPARK_LEVELS) - 1))] if high > low
+                    else SPARK_LEVELS[0] for c in candles)
+    header = '{code} over the last {period}: low ${low}, high ${high}\n'.format(
+        code=key[0], period=period, low=format_tick_price(low), high=format_tick_price(high))
+    rows = [spark, '',
+            'Time (UTC)'.ljust(13) + 'Open'.rjust(12) + 'High'.rjust(12) + 'Low'.rjust(12) + 'Close'.rjust(12)]
+    for t, open_price, high_price, low_price, close_price in candles:
+        rows.append(format_tick_time(t).ljust(13) + ''.join(format_tick_price(p).rjust(12) for p in
+                                                             (open_price, high_price, low_price, close_price)))
+    return header, rows
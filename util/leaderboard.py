@@ -0,0 +1,102 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+from util import database_connector, helpers, valuation
+
+# Length of one price epoch in seconds. The ranked snapshot is re-priced at most once per epoch.
+LEADERBOARD_TTL = float(os.getenv('LEADERBOARD_TTL', '60'))
+
+snapshot = {'epoch': None, 'prices': {}, 'names': {}, 'totals': {}, 'ranked': []}
+dirty_users = set()
+refresh_task = None
+refresh_lock = None
+
+
+def price_epoch():
+    return int(time.time() // LEADERBOARD_TTL)
+
+
+def mark_dirty(discord_id):
+    dirty_users.add(str(discord_id))
+
+
+database_connector.trade_listeners.append(mark_dirty)
+
+
+async def refresh(force=False):
+    global refresh_lock
+    if refresh_lock is None:
+        refresh_lock = asyncio.Lock()
+    async with refresh_lock, database_connector.scope():
+        epoch = price_epoch()
+        if not force and snapshot['epoch'] == epoch:
+            return
+        dirty_users.clear()
+        users = await database_connector.run(database_connector.get_all_users)
+        positions = await database_connector.run(database_connector.get_positions)
+        prices = await helpers.get_prices(((a['name'], a['is_crypto']) for assets in positions.values()
+                                           for a in assets if a['name'] != 'USDOLLAR'), failed=set())
+        # Assets missing from this round of prices (delisted, upstream hiccup) keep their last snapshot price,
+        # falling back to cost, so one bad ticker does not drop a player from the board.
+        totals = valuation.user_totals(valuation.value_positions(positions, prices, snapshot['prices']))
+
+        snapshot['names'] = dict(zip(users[0], users[1]))
+        snapshot['prices'] = {**snapshot['prices'], **prices}
+        snapshot['totals'] = totals
+        snapshot['ranked'] = sorted((-total, discord_id) for discord_id, total in totals.items())
+        snapshot['epoch'] = epoch
+        logging.info('Leaderboard re-priced {users} users, {assets} assets.'.format(users=len(totals),
+                                                                                  assets=len(prices)))
+
+
+# Re-values players who traded since the last refresh with the snapshot's prices and moves them in the ranking.
+async def apply_trades():
+    if not dirty_users:
+        return
+    changed = list(dirty_users)
+    dirty_users.difference_update(changed)
+    positions = await database_connector.run(database_connector.get_positions, changed)
+    totals = valuation.user_totals(valuation.value_positions(positions, snapshot['prices']))
+    ranked = snapshot['ranked']
+    for discord_id, new_total in totals.items():
+        old_total = snapshot['totals'].get(discord_id)
+        if old_total is not None:
+            index = bisect.bisect_left(ranked, (-old_total, discord_id))
+            if index < len(ranked) and ranked[index][1] == discord_id:
+                del ranked[index]
+        snapshot['totals'][discord_id] = new_total
+        bisect.insort(ranked, (-new_total, discord_id))
+
+
+def set_name(discord_id, name):
+    snapshot['names'][str(discord_id)] = name
+
+
+# Serves the current snapshot straight from memory. A stale snapshot is re-priced in the background;
+# only the very first call waits for pricing.
+async def get_ranked():
+    global refresh_task
+    if snapshot['epoch'] is None:
+        await refresh()
+    elif snapshot['epoch'] != price_epoch() and (refresh_task is None or refresh_task.done()):
+        refresh_task = asyncio.ensure_future(refresh())
+    await apply_trades()
+    return snapshot['ranked']
+
+
+async def format_leaderboard(server_members):
+    ranked = await get_ranked()
+    lb_string = ''
+    place = 0
+    for negative_total, discord_id in ranked:
+        if int(discord_id) not in server_members.keys():
+            continue
+        place += 1
+        name = snapshot['names'].get(discord_id) or server_members[int(discord_id)]
+        lb_string += '{place}. {name}: ${total}\n'.format(place=place,
+                                                          name=name,
+                                                          total='{:,.2f}'.format(-negative_total))
+    return lb_string
@@ -0,0 +1,187 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+METRICS_FILE = os.getenv('METRICS_FILE', '')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '15'))
+
+# Upper bounds of the histogram buckets, Prometheus style: seconds for latencies, plain numbers for counts.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Counters and histograms keyed by (name, labels). Updated from the event loop and the DB threads alike.
+lock = threading.Lock()
+counters = {}
+histograms = {}
+
+# What the current command or loop tick has cost so far: set by start_stats() and read back by its caller.
+current_stats = contextvars.ContextVar('metrics_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimated by linear interpolation inside the bucket the quantile falls in. Values above the last bucket are
+    # reported as the last bucket's bound.
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name, labels=None, amount=1):
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS):
+    key = (name, label_key(labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+@contextmanager
+def timer(name, labels=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels)
+
+
+def start_stats():
+    stats = {'db_queries': 0, 'db_seconds': 0.0, 'upstream_requests': 0}
+    return stats, current_stats.set(stats)
+
+
+def add_stat(field, amount):
+    stats = current_stats.get()
+    if stats is not None:
+        stats[field] += amount
+
+
+# Times one background loop tick, and the DB queries and upstream calls made during it.
+@contextmanager
+def loop_tick(loop):
+    stats, token = start_stats()
+    try:
+        with timer('stockbot_loop_tick_seconds', {'loop': loop}):
+            yield stats
+    finally:
+        current_stats.reset(token)
+        observe('stockbot_loop_db_queries', stats['db_queries'], {'loop': loop}, COUNT_BUCKETS)
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{k}="{v}"'.format(k=k, v=str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+# The Prometheus text exposition format.
+def render():
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted(histograms.items(), key=lambda item: item[0])
+        lines = []
+        typed = set()
+        for (name, labels), value in counter_items:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {name} counter'.format(name=name))
+            lines.append('{name}{labels} {value}'.format(name=name, labels=format_labels(labels), value=value))
+        for (name, labels), histogram in histogram_items:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {name} histogram'.format(name=name))
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append('{name}_bucket{labels} {value}'.format(
+                    name=name, labels=format_labels(labels, [('le', bound)]), value=cumulative))
+            lines.append('{name}_sum{labels} {value}'.format(name=name, labels=format_labels(labels),
+                                                             value=histogram.sum))
+            lines.append('{name}_count{labels} {value}'.format(name=name, labels=format_labels(labels),
+                                                               value=histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+# One line per latency histogram with its count, p50 and p99, for !stats.
+def summary(names=None):
+    with lock:
+        rows = []
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            if names is not None and name not in names:
+                continue
+            scale, unit = (1000, 'ms') if name.endswith('_seconds') else (1, '')
+            rows.append('{name}{labels} n={count} p50={p50:.1f}{unit} p99={p99:.1f}{unit}'.format(
+                name=name[len('stockbot_'):] if name.startswith('stockbot_') else name,
+                labels=format_labels(labels), count=histogram.count, unit=unit,
+                p50=histogram.quantile(0.5) * scale, p99=histogram.quantile(0.99) * scale))
+    return rows
+
+
+def record_command(command, seconds, stats, failed):
+    labels = {'command': command}
+    observe('stockbot_command_seconds', seconds, labels)
+    observe('stockbot_command_db_seconds', stats['db_seconds'], labels)
+    observe('stockbot_command_db_queries', stats['db_queries'], labels, COUNT_BUCKETS)
+    observe('stockbot_command_upstream_requests', stats['upstream_requests'], labels, COUNT_BUCKETS)
+    if failed:
+        inc('stockbot_command_errors_total', labels)
+
+
+def write_file(path=METRICS_FILE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain')
+
+
+# Serves render() on http://127.0.0.1:METRICS_PORT/metrics for a Prometheus scraper on the same host.
+async def start_http_server(port=METRICS_PORT, host='127.0.0.1'):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info('Serving metrics on port ' + str(port))
+    return runner
@@ -0,0 +1,21 @@
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from util import database_connector
+
+# Creates missing tables, applies pending schema migrations and, with --check, fails if a hot query would be
+# answered with a full table scan.
+#   python -m util.migrate [--check]
+if __name__ == '__main__':
+    database_connector.create_database()
+    print('Schema is at version {version}.'.format(version=database_connector.migrate()))
+    if '--check' in sys.argv:
+        problems = database_connector.check_query_plans()
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print('All hot queries use an index.')
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+
+from util import metrics
+
+MESSAGE_LIMIT = 2000
+# Channels flushed at the same time. Messages to one channel are always sent one after another, so each channel's
+# rate limit bucket sees a short sequence instead of a burst.
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', '5'))
+FENCE = '```'
+
+
+# Joins texts with newlines into as few messages as fit the limit. A text longer than the limit on its own is split
+# at line breaks, or hard-cut if a single line is too long.
+def merge(texts, limit=MESSAGE_LIMIT):
+    messages = []
+    current = ''
+    for text in texts:
+        for part in split(text, limit):
+            if current and len(current) + 1 + len(part) > limit:
+                messages.append(current)
+                current = ''
+            current = current + '\n' + part if current else part
+    if current:
+        messages.append(current)
+    return messages
+
+
+# A cut inside a ``` code block closes the block at the end of one part and reopens it at the start of the next,
+# so both halves still render as code.
+def split(text, limit):
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ''
+    in_fence = False
+    reserve = 2 * (len(FENCE) + 1)
+    for line in text.split('\n'):
+        while True:
+            size = limit - reserve if in_fence or FENCE in line else limit
+            piece, line = line[:size], line[size:]
+            fence_after = in_fence != (piece.count(FENCE) % 2 == 1)
+            closing = len(FENCE) + 1 if fence_after else 0
+            if current and len(current) + 1 + len(piece) + closing > limit:
+                parts.append(current + '\n' + FENCE if in_fence else current)
+                current = FENCE if in_fence else ''
+            current = current + '\n' + piece if current else piece
+            in_fence = fence_after
+            if not line:
+                break
+    if current:
+        parts.append(current)
+    return parts
+
+
+# Buffers the notifications of one alert or limit order pass per channel and sends them merged when flushed.
+class Outbox:
+    def __init__(self):
+        self.messages = {}
+
+    def __len__(self):
+        return sum(len(texts) for texts in self.messages.values())
+
+    def add(self, channel_id, text):
+        self.messages.setdefault(int(channel_id), []).append(text)
+
+    # get_channel maps a channel id to an object with an async send(); channels it cannot find are skipped.
+    async def flush(self, get_channel):
+        messages, self.messages = self.messages, {}
+        slots = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+        async def send_channel(channel_id, texts):
+            channel = get_channel(channel_id)
+            if channel is None:
+                return
+            async with slots:
+                for message in merge(texts):
+                    try:
+                        await channel.send(message)
+                        metrics.inc('stockbot_notifications_sent_total')
+                    except Exception as e:
+                        metrics.inc('stockbot_notifications_failed_total')
+                        logging.error('Error sending notification to {channel}: {error}'.format(channel=channel_id,
+                                                                                                 error=repr(e)))
+
+        metrics.inc('stockbot_notifications_queued_total', amount=sum(len(texts) for texts in messages.values()))
+        await asyncio.gather(*[send_channel(channel_id, texts) for channel_id, texts in messages.items()])
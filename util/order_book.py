@@ -0,0 +1,130 @@
+import logging
+
+from util import database_connector, helpers, symbols
+from util.trigger_index import TriggerIndex
+
+# Standing limit orders, loaded from the database once and kept in sync by !limit and !xorder.
+index = TriggerIndex()
+orders = {}
+loaded = False
+# Set when the order engine runs in a worker process: book changes are sent there instead of applied here.
+remote = None
+
+
+async def ensure_loaded():
+    global loaded
+    if loaded:
+        return
+    rows = await database_connector.run(database_connector.get_limit_orders, None)
+    if loaded:
+        return
+    index.clear()
+    orders.clear()
+    for o in rows:
+        add_order(o.id, o.discord_id, o.channel_id, o.asset_code, o.volume, o.is_crypto, o.is_sale,
+                  o.is_less_than, o.price_per_unit)
+    loaded = True
+
+
+def add_order(order_id, discord_id, channel_id, asset, volume, is_crypto, is_sale, is_less_than, price):
+    if remote is not None:
+        remote('add_order', order_id, discord_id, channel_id, asset, volume, is_crypto, is_sale, is_less_than, price)
+        return
+    key = helpers.price_key(asset, is_crypto)
+    orders[order_id] = {'id': order_id,
+                        'discord_id': str(discord_id),
+                        'channel_id': int(channel_id),
+                        'asset_code': key[0],
+                        'volume': volume,
+                        'is_crypto': key[1],
+                        'is_sale': is_sale,
+                        'is_less_than': is_less_than,
+                        'price_per_unit': float(price)}
+    index.add(order_id, key, is_less_than, price)
+
+
+def remove_order(order_id, discord_id):
+    if remote is not None:
+        remote('remove_order', order_id, discord_id)
+        return
+    o = orders.get(order_id)
+    if o is None or o['discord_id'] != str(discord_id):
+        return
+    del orders[order_id]
+    index.remove(order_id)
+
+
+async def delete_order(order_id, discord_id):
+    remove_order(order_id, discord_id)
+    return await database_connector.run(database_connector.delete_limit_order, order_id, discord_id)
+
+
+# Deletes many orders with one statement.
+async def delete_orders(orders):
+    orders = list(orders)
+    for o in orders:
+        remove_order(o['id'], o['discord_id'])
+    if orders:
+        return await database_connector.run(database_connector.delete_limit_orders, [o['id'] for o in orders])
+
+
+def price_keys():
+    return index.keys()
+
+
+# Matches one round of prices against the book. Returns the orders that triggered, in price priority per asset,
+# and the orders whose asset the upstream does not know. Assets in failed are skipped until the next round.
+# keys limits the pass to some assets, e.g. the ones that just ticked on a price stream.
+def match(prices, failed=(), keys=None):
+    triggered = []
+    invalid = []
+    for key in price_keys() if keys is None else price_keys() & set(keys):
+        if key in failed:
+            logging.error('Skipping limit orders for {asset}: price unavailable.'.format(asset=key[0]))
+            continue
+        current_price = prices.get(key)
+        if current_price is None:
+            # Only a symbol confirmed unknown invalidates its limit orders; anything else may be a transient gap.
+            if symbols.lookup(*key) is False:
+                invalid.extend(orders[order_id] for order_id in index.ids_for(key))
+            else:
+                logging.error('Skipping limit orders for {asset}: no price returned.'.format(asset=key[0]))
+            continue
+        for order_id in index.triggered(key, current_price):
+            triggered.append(dict(orders[order_id], current_price=current_price))
+    return triggered, invalid
+
+
+# An order that raises while filling is logged and left in the database; the ones that completed are always
+# deleted, so a restart cannot load and fill them again.
+def execute_fills(triggered, display_names):
+    results = []
+    completed = []
+    try:
+        for o in triggered:
+            try:
+                message = helpers.transact_asset(o['discord_id'], display_names.get(o['discord_id']),
+                                                 o['asset_code'], o['volume'], str(o['current_price']), o['is_sale'],
+                                                 o['is_crypto'])
+            except Exception:
+                logging.exception('Error filling order {id}.'.format(id=o['id']))
+                results.append((o, 'Issue filling {name}\'s order {id}, it was not executed.'.format(
+                    name=display_names.get(o['discord_id']), id=o['id'])))
+                continue
+            completed.append(o['id'])
+            results.append((o, message))
+    finally:
+        if completed:
+            database_connector.delete_limit_orders(completed)
+    return results
+
+
+# Takes the triggered orders out of the book before the first await, so an overlapping pass cannot fill them
+# again, then executes them one after another on the DB pool so each sees the balance left by the previous fill
+# and deletes the filled ones in one statement. Returns (order, result message) pairs.
+async def fill(triggered, display_names):
+    if not triggered:
+        return []
+    for o in triggered:
+        remove_order(o['id'], o['discord_id'])
+    return await database_connector.run(execute_fills, triggered, display_names)
@@ -0,0 +1,119 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Layout of the shared block: a header of (symbol count, capacity), then the symbol table, then one price slot per
+# symbol. Symbols are only ever appended, so a slot index never changes once published.
+HEADER = np.dtype([('count', 'i8'), ('capacity', 'i8')])
+SYMBOL = np.dtype([('code', 'S15'), ('is_crypto', 'i1')])
+SLOT = np.dtype([('seq', 'i8'), ('price', 'f8'), ('updated', 'f8')])
+
+
+# Latest prices shared between processes without copying: one writer (the worker) publishes, any number of
+# readers look prices up by price_key. Each slot is guarded by a sequence number that is odd while it is being
+# written, so readers retry instead of seeing a torn price.
+class PriceBoard:
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray(1, dtype=HEADER, buffer=shm.buf)
+        capacity = int(self.header['capacity'][0])
+        self.symbols = np.ndarray(capacity, dtype=SYMBOL, buffer=shm.buf, offset=HEADER.itemsize)
+        self.slots = np.ndarray(capacity, dtype=SLOT, buffer=shm.buf,
+                                offset=HEADER.itemsize + SYMBOL.itemsize * capacity)
+        self.index = {}
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def capacity(self):
+        return len(self.slots)
+
+    @classmethod
+    def create(cls, capacity):
+        size = HEADER.itemsize + (SYMBOL.itemsize + SLOT.itemsize) * capacity
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray(1, dtype=HEADER, buffer=shm.buf)
+        header['count'] = 0
+        header['capacity'] = capacity
+        del header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    # Picks up symbols other processes appended since the last call.
+    def refresh_index(self):
+        count = int(self.header['count'][0])
+        for i in range(len(self.index), count):
+            symbol = self.symbols[i]
+            self.index[(symbol['code'].decode(), int(symbol['is_crypto']))] = i
+
+    def slot_for(self, key):
+        i = self.index.get(key)
+        if i is None:
+            self.refresh_index()
+            i = self.index.get(key)
+        if i is None:
+            i = len(self.index)
+            if i >= self.capacity:
+                return None
+            self.symbols[i] = (key[0].encode(), key[1])
+            self.slots[i] = (0, np.nan, 0.0)
+            self.header['count'] = i + 1
+            self.index[key] = i
+        return i
+
+    # Writer side. Symbols beyond the board's capacity are not published.
+    def publish(self, prices, updated=None):
+        updated = time.time() if updated is None else updated
+        for key, price in prices.items():
+            i = self.slot_for(key)
+            if i is None:
+                continue
+            slot = self.slots[i:i + 1]
+            slot['seq'] += 1
+            slot['price'] = price
+            slot['updated'] = updated
+            slot['seq'] += 1
+
+    # A slot as (price, updated); None if it was never published or kept changing while being read.
+    def read_slot(self, i):
+        for attempt in range(3):
+            seq, price, updated = self.slots[i].tolist()
+            if seq % 2 == 0 and self.slots[i]['seq'] == seq:
+                return (price, updated) if seq != 0 else None
+        return None
+
+    # Reader side: price_key -> price for the keys on the board, skipping prices older than max_age seconds.
+    def read(self, keys, max_age=None):
+        self.refresh_index()
+        oldest = time.time() - max_age if max_age is not None else None
+        prices = {}
+        for key in keys:
+            i = self.index.get(key)
+            slot = self.read_slot(i) if i is not None else None
+            if slot is None or (oldest is not None and slot[1] < oldest):
+                continue
+            prices[key] = slot[0]
+        return prices
+
+    # Every published price as price_key -> (price, updated).
+    def entries(self):
+        self.refresh_index()
+        entries = {}
+        for key, i in self.index.items():
+            slot = self.read_slot(i)
+            if slot is not None:
+                entries[key] = slot
+        return entries
+
+    def close(self):
+        self.header = self.symbols = self.slots = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import aiohttp
+
+from util import resilience
+
+REQUEST_TIMEOUT = float(os.getenv('PRICE_REQUEST_TIMEOUT', '10'))
+MAX_CONNECTIONS = int(os.getenv('PRICE_MAX_CONNECTIONS', '20'))
+MAX_CONCURRENT_REQUESTS = int(os.getenv('PRICE_MAX_CONCURRENT_REQUESTS', '10'))
+
+session = None
+request_slots = None
+
+
+# The session is created lazily so it binds to the running event loop and then lives for the whole process,
+# keeping upstream connections alive between quotes.
+def get_session():
+    global session, request_slots
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                                        headers={'User-agent': 'Mozilla/5.0'})
+        request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return session
+
+
+async def fetch(url, params, headers, timeout, as_json):
+    client = get_session()
+    kwargs = {} if timeout is None else {'timeout': aiohttp.ClientTimeout(total=timeout)}
+    async with request_slots:
+        async with client.get(url, params=params, headers=headers, **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None) if as_json else await response.text()
+
+
+# With a provider name, the request goes through that provider's rate limiter, retries and circuit breaker.
+async def get_json(url, params=None, headers=None, timeout=None, provider=None):
+    if provider is None:
+        return await fetch(url, params, headers, timeout, True)
+    return await resilience.get_provider(provider).call(lambda: fetch(url, params, headers, timeout, True))
+
+
+async def get_text(url, params=None, headers=None, timeout=None, provider=None):
+    if provider is None:
+        return await fetch(url, params, headers, timeout, False)
+    return await resilience.get_provider(provider).call(lambda: fetch(url, params, headers, timeout, False))
+
+
+async def close():
+    global session
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
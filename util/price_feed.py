@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+from util import helpers, price_client
+
+BINANCE_STREAM_URL = os.getenv('BINANCE_STREAM_URL', 'wss://stream.binance.com:9443/ws/!miniTicker@arr')
+STREAM_RECONNECT_DELAY = float(os.getenv('STREAM_RECONNECT_DELAY', '5'))
+
+
+# A source of pushed price updates. Subscribers are coroutines called with a dict of price_key -> price holding
+# only the assets that ticked.
+class PriceFeed:
+    def __init__(self):
+        self.subscribers = []
+        self.task = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    # Whether updates for this price_key are expected from the feed, so callers can stop polling for it.
+    def covers(self, key):
+        return False
+
+    async def publish(self, prices):
+        if not prices:
+            return
+        results = await asyncio.gather(*[callback(prices) for callback in self.subscribers], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error('Error in price subscriber: ' + repr(result))
+
+    async def run(self):
+        raise NotImplementedError
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+# Streams Binance's all-market mini ticker and publishes the preferred USD market of every base asset.
+class BinanceTickerFeed(PriceFeed):
+    def __init__(self, url=BINANCE_STREAM_URL):
+        super().__init__()
+        self.url = url
+        self.products = None
+        self.symbols = {}
+
+    def symbol_map(self):
+        if self.products is not helpers.crypto_usd_products:
+            self.products = helpers.crypto_usd_products
+            self.symbols = {p.get('s', p['b'] + p['q']).upper(): base for base, p in self.products.items()}
+        return self.symbols
+
+    def covers(self, key):
+        return key[1] == 1 and key[0] in helpers.crypto_usd_products
+
+    def parse(self, tickers):
+        symbols = self.symbol_map()
+        prices = {}
+        for t in tickers:
+            base = symbols.get(t['s'])
+            if base is not None:
+                prices[(base, 1)] = float(t['c'])
+        return prices
+
+    async def run(self):
+        while True:
+            try:
+                await helpers.refresh_crypto_products()
+                async with price_client.get_session().ws_connect(self.url, heartbeat=30) as ws:
+                    logging.info('Connected to price stream ' + self.url)
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            await self.publish(self.parse(msg.json()))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error('Price stream error: ' + repr(e))
+            await asyncio.sleep(STREAM_RECONNECT_DELAY)
+
+
+# A local feed driven by push(), for tests and offline runs.
+class FakePriceFeed(PriceFeed):
+    def __init__(self, covered=()):
+        super().__init__()
+        self.covered = set(covered)
+        self.queue = asyncio.Queue()
+
+    def covers(self, key):
+        return key in self.covered
+
+    def put(self, prices):
+        self.queue.put_nowait(dict(prices))
+
+    async def push(self, prices):
+        await self.publish(dict(prices))
+
+    async def run(self):
+        while True:
+            await self.publish(await self.queue.get())
+
+
+def create_feed(name):
+    if not name:
+        return None
+    if name == 'binance':
+        return BinanceTickerFeed()
+    if name == 'fake':
+        return FakePriceFeed()
+    raise ValueError('Unknown price stream: ' + name)
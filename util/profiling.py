@@ -0,0 +1,129 @@
+import contextvars
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Invocations slower than PROFILE_THRESHOLD seconds are saved; 0 turns profiling off. Only a PROFILE_SAMPLE_RATE
+# fraction of invocations is profiled at all, and only one at a time.
+PROFILE_THRESHOLD = float(os.getenv('PROFILE_THRESHOLD', '0'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.1'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+active = None
+current = contextvars.ContextVar('profile', default=None)
+
+
+# One profiled invocation: a profiler on the event loop thread for its whole duration, plus one per database call
+# it runs on the DB threads. The loop profile also sees whatever else ran on the loop in the meantime.
+class Profile:
+    def __init__(self, name, arguments):
+        self.name = name
+        self.arguments = arguments
+        self.started = time.perf_counter()
+        self.loop_profiler = cProfile.Profile()
+        self.thread_profilers = []
+        self.lock = threading.Lock()
+        self.token = None
+
+    def add(self, profiler):
+        with self.lock:
+            self.thread_profilers.append(profiler)
+
+
+def start(name, arguments=''):
+    global active
+    if PROFILE_THRESHOLD <= 0 or active is not None or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    profile = Profile(name, arguments)
+    try:
+        profile.loop_profiler.enable()
+    except ValueError:
+        return None
+    active = profile
+    profile.token = current.set(profile)
+    return profile
+
+
+# Stops the profile and saves it if the invocation went past the threshold. stats are the metrics counts
+# (DB queries, upstream requests) of the same invocation.
+def finish(profile, stats=None):
+    global active
+    if profile is None:
+        return
+    profile.loop_profiler.disable()
+    active = None
+    current.reset(profile.token)
+    elapsed = time.perf_counter() - profile.started
+    if elapsed < PROFILE_THRESHOLD:
+        return
+    try:
+        save(profile, elapsed, stats)
+    except Exception as e:
+        logging.error('Error saving profile of ' + profile.name + ': ' + repr(e))
+
+
+@contextmanager
+def profiled(name, stats=None, arguments=''):
+    profile = start(name, arguments)
+    try:
+        yield profile
+    finally:
+        finish(profile, stats)
+
+
+# Runs fn, profiling it when it was called on behalf of a profiled invocation. Used by database_connector.run.
+def call(fn, *args, **kwargs):
+    profile = current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already owns the interpreter (Python 3.12+ allows only one at a time).
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profile.add(profiler)
+
+
+def save(profile, elapsed, stats):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, '{time}-{ms:03d}-{name}'.format(time=time.strftime('%Y%m%d-%H%M%S'),
+                                                                      ms=int(time.time() * 1000) % 1000,
+                                                                      name=profile.name.replace(' ', '_')))
+    combined = pstats.Stats(profile.loop_profiler)
+    for profiler in profile.thread_profilers:
+        combined.add(profiler)
+    combined.dump_stats(path + '.prof')
+    with open(path + '.json', 'w') as f:
+        json.dump({'name': profile.name,
+                   'arguments': profile.arguments,
+                   'elapsed_seconds': round(elapsed, 6),
+                   'threshold_seconds': PROFILE_THRESHOLD,
+                   'db_calls': len(profile.thread_profilers),
+                   'stats': stats or {},
+                   'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')}, f, indent=2)
+    logging.info('Saved profile of {name} ({elapsed:.3f}s) to {path}.prof'.format(name=profile.name,
+                                                                                  elapsed=elapsed, path=path))
+    rotate()
+
+
+def rotate():
+    saved = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.prof')))
+    for path in saved[:max(0, len(saved) - PROFILE_KEEP)]:
+        for stale_path in (path, path[:-len('.prof')] + '.json'):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
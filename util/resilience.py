@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from util import metrics
+
+# Defaults for every upstream provider. Each can be overridden per provider with the provider name as prefix,
+# e.g. YAHOO_RATE_LIMIT or BINANCE_CIRCUIT_RESET_TIMEOUT.
+RATE_LIMIT = float(os.getenv('PRICE_RATE_LIMIT', '10'))
+RATE_BURST = float(os.getenv('PRICE_RATE_BURST', '20'))
+RETRIES = int(os.getenv('PRICE_RETRIES', '2'))
+RETRY_BACKOFF = float(os.getenv('PRICE_RETRY_BACKOFF', '0.5'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def provider_setting(name, setting, default):
+    return type(default)(os.getenv(name.upper() + '_' + setting, default))
+
+
+# Hands out up to capacity requests at once and refills at rate per second; acquire() waits for a token.
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Opens after failure_threshold consecutive failures and rejects calls for reset_timeout seconds. After that one
+# trial call is let through: success closes the circuit, failure opens it again.
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+# Timeouts, dropped connections, 429s and 5xx are worth retrying and count against the circuit. Other errors
+# (a 404, a malformed response) mean the provider is up, so they are raised straight away.
+def is_transient(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+class Provider:
+    def __init__(self, name):
+        self.name = name
+        self.bucket = TokenBucket(provider_setting(name, 'RATE_LIMIT', RATE_LIMIT),
+                                  provider_setting(name, 'RATE_BURST', RATE_BURST))
+        self.breaker = CircuitBreaker(provider_setting(name, 'CIRCUIT_FAILURE_THRESHOLD', CIRCUIT_FAILURE_THRESHOLD),
+                                      provider_setting(name, 'CIRCUIT_RESET_TIMEOUT', CIRCUIT_RESET_TIMEOUT))
+        self.retries = provider_setting(name, 'RETRIES', RETRIES)
+        self.retry_backoff = provider_setting(name, 'RETRY_BACKOFF', RETRY_BACKOFF)
+
+    # Runs request (a coroutine function) under the rate limit, retrying transient errors with full-jitter
+    # exponential backoff. Fails fast with CircuitOpenError while the provider is considered down.
+    async def call(self, request):
+        labels = {'provider': self.name}
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.inc('stockbot_upstream_rejected_total', labels)
+                raise CircuitOpenError(self.name + ' is unavailable')
+            await self.bucket.acquire()
+            metrics.inc('stockbot_upstream_requests_total', labels)
+            metrics.add_stat('upstream_requests', 1)
+            started = time.perf_counter()
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                self.breaker.trial = False
+                raise
+            except Exception as e:
+                metrics.observe('stockbot_upstream_seconds', time.perf_counter() - started, labels)
+                metrics.inc('stockbot_upstream_errors_total', labels)
+                if not is_transient(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+                logging.info('Retrying {name} in {delay:.2f}s after {error}'.format(name=self.name, delay=delay,
+                                                                                  error=repr(e)))
+                await asyncio.sleep(delay)
+                continue
+            metrics.observe('stockbot_upstream_seconds', time.perf_counter() - started, labels)
+            self.breaker.record_success()
+            return result
+
+
+providers = {}
+
+
+def get_provider(name):
+    provider = providers.get(name)
+    if provider is None:
+        provider = providers[name] = Provider(name)
+    return provider
@@ -0,0 +1,112 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from util import database_connector, helpers, tick_history, valuation
+
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '3600'))
+SNAPSHOT_TOP_POSITIONS = int(os.getenv('SNAPSHOT_TOP_POSITIONS', '3'))
+LEADERBOARD_PERIODS = {'day': 86400, 'week': 7 * 86400, 'month': 30 * 86400}
+
+
+# One portfolio_snapshot row per user of a valuation: total value, cash and the largest positions by value as
+# 'CODE:value' pairs.
+def snapshot_rows(values, snapshot_date):
+    keys = values['keys']
+    is_cash = np.array([key[0] == 'USDOLLAR' for key in keys], dtype=bool)[values['asset_index']]
+    cash = np.bincount(values['user_index'], weights=np.where(is_cash, values['value'], 0.0),
+                       minlength=len(values['users']))
+    top_positions = {u: [] for u in range(len(values['users']))}
+    for row in np.lexsort((-values['value'], values['user_index'])):
+        u = values['user_index'][row]
+        if not is_cash[row] and len(top_positions[u]) < SNAPSHOT_TOP_POSITIONS:
+            top_positions[u].append('{code}:{value:.2f}'.format(code=keys[values['asset_index'][row]][0],
+                                                                 value=values['value'][row]))
+    return [{'discord_id': discord_id,
+             'snapshot_date': snapshot_date,
+             'total_value': float(values['totals'][u]),
+             'cash': float(cash[u]),
+             'top_positions': ','.join(top_positions[u])[:255]}
+            for u, discord_id in enumerate(values['users'])]
+
+
+# Values every player's holdings in one pass, each held asset priced once, and stores the result as one snapshot
+# run. Assets that cannot be priced use their last known price, then their average cost.
+async def take_snapshot():
+    async with database_connector.scope():
+        positions = await database_connector.run(database_connector.get_positions)
+        prices = await helpers.get_prices(((a['name'], a['is_crypto']) for assets in positions.values()
+                                           for a in assets if a['name'] != 'USDOLLAR'), failed=set(), stale=set())
+        rows = snapshot_rows(valuation.value_positions(positions, prices), datetime.utcnow().replace(microsecond=0))
+        if rows:
+            await database_connector.run(database_connector.save_snapshots, rows)
+        await database_connector.run(database_connector.expire_snapshots)
+        logging.info('Saved portfolio snapshots for {users} users, {assets} assets.'.format(users=len(rows),
+                                                                                          assets=len(prices)))
+
+
+# '1d', '2w' as for !chart, or day, week or month. None if the period is not understood.
+def parse_period(period):
+    return LEADERBOARD_PERIODS.get(period.lower()) or tick_history.parse_period(period)
+
+
+def format_change(start, end):
+    change = end - start
+    return '{sign}${amount} ({sign}{percent}%)'.format(
+        sign='+' if change >= 0 else '-',
+        amount='{:,.2f}'.format(abs(change)),
+        percent=str(round(abs(change) / start * 100, 2)) if start else '0.0')
+
+
+# (header, rows) of a player's snapshots over the last `seconds`: a sparkline of total value and up to
+# CHART_BUCKETS evenly spaced snapshots. None if there are no snapshots in the period.
+def format_performance(discord_id, name, period, seconds):
+    snapshots = database_connector.get_snapshots(discord_id, datetime.utcnow() - timedelta(seconds=seconds))
+    if not snapshots:
+        return None
+    totals = [s.total_value for s in snapshots]
+    low, high = min(totals), max(totals)
+    levels = helpers.SPARK_LEVELS
+    spark = ''.join(levels[int((t - low) / (high - low) * (len(levels) - 1))] if high > low else levels[0]
+                    for t in totals)
+    header = '{name} over the last {period}: ${start} to ${end}, {change}\n'.format(
+        name=name, period=period, start='{:,.2f}'.format(totals[0]), end='{:,.2f}'.format(totals[-1]),
+        change=format_change(totals[0], totals[-1]))
+    rows = [spark, '', 'Time (UTC)'.ljust(13) + 'Value'.rjust(15) + 'Cash'.rjust(15) + '  Top Positions']
+    shown = sorted(set(np.linspace(0, len(snapshots) - 1, min(len(snapshots), helpers.CHART_BUCKETS))
+                       .round().astype(int).tolist()))
+    for i in shown:
+        s = snapshots[i]
+        rows.append(s.snapshot_date.strftime('%m-%d %H:%M').ljust(13) +
+                    '{:,.2f}'.format(s.total_value).rjust(15) + '{:,.2f}'.format(s.cash).rjust(15) + '  ' +
+                    ' '.join(p.split(':')[0] for p in s.top_positions.split(',') if p))
+    return header, rows
+
+
+# Players ranked by the percent change of their value between the first snapshot run of the period and the latest
+# run. Players without a snapshot at the start of the period are left out.
+def format_period_leaderboard(server_members, period, seconds):
+    start_date, start_totals = database_connector.get_snapshot_run(since=datetime.utcnow() -
+                                                                   timedelta(seconds=seconds))
+    end_date, end_totals = database_connector.get_snapshot_run(latest=True)
+    if start_date is None or start_date == end_date:
+        return 'Not enough portfolio snapshots for the last {period} yet.'.format(period=period)
+    changes = []
+    for discord_id, end_total in end_totals.items():
+        start_total = start_totals.get(discord_id)
+        if start_total is None or int(discord_id) not in server_members:
+            continue
+        changes.append(((end_total - start_total) / start_total if start_total else 0.0, discord_id, start_total,
+                        end_total))
+    changes.sort(reverse=True)
+    names = database_connector.get_display_names([c[1] for c in changes])
+    lb_string = 'Since {date} UTC:\n'.format(date=start_date.strftime('%m-%d %H:%M'))
+    for place, (ratio, discord_id, start_total, end_total) in enumerate(changes, 1):
+        lb_string += '{place}. {name}: ${total} {change}\n'.format(
+            place=place,
+            name=names.get(discord_id) or server_members[int(discord_id)],
+            total='{:,.2f}'.format(end_total),
+            change=format_change(start_total, end_total))
+    return lb_string
@@ -0,0 +1,104 @@
+import logging
+import os
+import time
+
+from util import price_client
+
+STOCK_SYMBOLS_URL = os.getenv('STOCK_SYMBOLS_URL', 'https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqtraded.txt')
+STOCK_SYMBOLS_FILE = os.getenv('STOCK_SYMBOLS_FILE', 'stock_symbols.txt')
+STOCK_SYMBOLS_TTL = float(os.getenv('STOCK_SYMBOLS_TTL', '86400'))
+SYMBOL_NEGATIVE_TTL = float(os.getenv('SYMBOL_NEGATIVE_TTL', '3600'))
+
+stock_symbols = set()
+crypto_symbols = set()
+known = set()
+unknown = {}
+
+
+def set_crypto_symbols(codes):
+    global crypto_symbols
+    crypto_symbols = {code.upper() for code in codes}
+
+
+def set_stock_symbols(codes):
+    global stock_symbols
+    stock_symbols = {code.upper() for code in codes}
+
+
+def mark_known(code, is_crypto):
+    key = (code.upper(), 1 if is_crypto else 0)
+    known.add(key)
+    unknown.pop(key, None)
+
+
+def mark_unknown(code, is_crypto):
+    unknown[(code.upper(), 1 if is_crypto else 0)] = time.monotonic() + SYMBOL_NEGATIVE_TTL
+
+
+# True if the symbol exists for that asset class, False if it is known not to, None if only the upstream can tell.
+# The stock directory only lists Nasdaq-traded securities, so a ticker missing from it (OTC, indices, foreign
+# listings) is left for the upstream to decide; only a ticker the upstream returned no quote for is False.
+def lookup(code, is_crypto):
+    key = (code.upper(), 1 if is_crypto else 0)
+    expires = unknown.get(key)
+    if expires is not None:
+        if expires > time.monotonic():
+            return False
+        del unknown[key]
+    if key in known:
+        return True
+    if is_crypto:
+        return key[0] in crypto_symbols if crypto_symbols else None
+    return True if key[0] in stock_symbols else None
+
+
+def asset_class(code):
+    if lookup(code, 0):
+        return 'stock'
+    if lookup(code, 1):
+        return 'crypto'
+    return None
+
+
+# nasdaqtraded.txt is pipe separated with a header row and a trailing "File Creation Time" row. Symbols are
+# converted to Yahoo's notation: BRK.B -> BRK-B, preferred AGM$A -> AGM-PA.
+def parse_nasdaq_symbols(data):
+    lines = data.splitlines()
+    if not lines:
+        return []
+    header = lines[0].split('|')
+    symbol_column = header.index('Symbol')
+    test_column = header.index('Test Issue') if 'Test Issue' in header else None
+    codes = []
+    for line in lines[1:]:
+        fields = line.split('|')
+        if len(fields) <= symbol_column or line.startswith('File Creation Time'):
+            continue
+        if test_column is not None and fields[test_column] == 'Y':
+            continue
+        codes.append(fields[symbol_column].replace('.', '-').replace('$', '-P'))
+    return codes
+
+
+def load_stock_symbols_file(path=STOCK_SYMBOLS_FILE):
+    with open(path) as f:
+        set_stock_symbols(line.strip() for line in f if line.strip())
+
+
+# Loads the stored stock symbol list, downloading a new one first when it is missing or older than
+# STOCK_SYMBOLS_TTL. A failed download keeps whatever list is already on disk or in memory.
+async def refresh_stock_symbols(force=False, path=STOCK_SYMBOLS_FILE):
+    fresh = os.path.exists(path) and time.time() - os.path.getmtime(path) < STOCK_SYMBOLS_TTL
+    if force or not fresh:
+        try:
+            codes = parse_nasdaq_symbols(await price_client.get_text(STOCK_SYMBOLS_URL))
+            if codes:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write('\n'.join(codes))
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error('Error downloading stock symbols: ' + repr(e))
+    if os.path.exists(path) and (force or not fresh or not stock_symbols):
+        load_stock_symbols_file(path)
+        logging.info('Loaded {count} stock symbols.'.format(count=len(stock_symbols)))
@@ -0,0 +1,240 @@
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+
+TICK_DIR = os.getenv('TICK_DIR', 'ticks')
+TICK_RING_SIZE = int(os.getenv('TICK_RING_SIZE', '4096'))
+TICK_SEGMENT_RECORDS = int(os.getenv('TICK_SEGMENT_RECORDS', '65536'))
+TICK_RETENTION = float(os.getenv('TICK_RETENTION', str(7 * 86400)))
+
+TICK = np.dtype([('t', 'f8'), ('p', 'f8')])
+PERIOD_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+# The most recent ticks of one asset in fixed arrays. The last `unflushed` of them have not been written to disk.
+class TickRing:
+    def __init__(self, capacity):
+        self.times = np.empty(capacity)
+        self.prices = np.empty(capacity)
+        self.start = 0
+        self.count = 0
+        self.unflushed = 0
+
+    @property
+    def capacity(self):
+        return len(self.times)
+
+    def last_time(self):
+        return self.times[(self.start + self.count - 1) % self.capacity] if self.count else None
+
+    def append(self, t, price):
+        if self.count < self.capacity:
+            i = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[i] = t
+        self.prices[i] = price
+        self.unflushed += 1
+
+    # Contents in time order, optionally only the last n.
+    def ordered(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        first = (self.start + self.count - n) % self.capacity
+        indexes = (first + np.arange(n)) % self.capacity
+        return self.times[indexes], self.prices[indexes]
+
+
+# Observed prices per price_key: recent ticks in memory, everything older in append-only segment files of
+# (time, price) records read back through memory maps. Ticks are kept in time order per asset; an observation
+# older than the asset's last one is dropped. Flushes may run on another thread than recording: lock keeps the
+# rings' unflushed counts and the segment list consistent, and makes a flush append its ticks in order.
+# Whenever an asset starts a new segment, its segments holding only ticks older than `retention` seconds before
+# the newest tick are deleted (0 keeps them all), and the maps of its older segments are dropped from the cache.
+class TickStore:
+    def __init__(self, directory=TICK_DIR, ring_size=TICK_RING_SIZE, segment_records=TICK_SEGMENT_RECORDS,
+                 retention=TICK_RETENTION):
+        self.directory = directory
+        self.ring_size = ring_size
+        self.segment_records = segment_records
+        self.retention = retention
+        self.rings = {}
+        self.segments = None
+        self.maps = {}
+        self.lock = threading.RLock()
+
+    def asset_dir(self, key):
+        return os.path.join(self.directory, '{code}_{asset_class}'.format(code=key[0],
+                                                                           asset_class='c' if key[1] else 's'))
+
+    def load_segments(self):
+        self.segments = {}
+        for path in glob.glob(os.path.join(self.directory, '*_[cs]')):
+            code, asset_class = os.path.basename(path).rsplit('_', 1)
+            self.segments[(code, 1 if asset_class == 'c' else 0)] = sorted(glob.glob(os.path.join(path, '*.ticks')))
+
+    def segment_paths(self, key):
+        with self.lock:
+            if self.segments is None:
+                self.load_segments()
+            return self.segments.setdefault(key, [])
+
+    def record(self, key, price, t=None):
+        t = time.time() if t is None else t
+        with self.lock:
+            ring = self.rings.get(key)
+            if ring is None:
+                ring = self.rings[key] = TickRing(self.ring_size)
+            last = ring.last_time()
+            if last is not None and t <= last:
+                return
+            if ring.unflushed == ring.capacity:
+                self.flush(key)
+            ring.append(t, price)
+
+    def record_many(self, prices, t=None):
+        t = time.time() if t is None else t
+        for key, price in prices.items():
+            self.record(key, price, t)
+
+    # Appends the ticks not yet on disk to the asset's newest segment, starting a new one when it is full.
+    def flush(self, key):
+        with self.lock:
+            self.flush_locked(key)
+
+    def flush_locked(self, key):
+        ring = self.rings.get(key)
+        if ring is None or ring.unflushed == 0:
+            return
+        times, prices = ring.ordered(ring.unflushed)
+        records = np.empty(len(times), dtype=TICK)
+        records['t'] = times
+        records['p'] = prices
+        paths = self.segment_paths(key)
+        written = 0
+        while written < len(records):
+            path = paths[-1] if paths else None
+            size = os.path.getsize(path) // TICK.itemsize if path else self.segment_records
+            if size >= self.segment_records:
+                os.makedirs(self.asset_dir(key), exist_ok=True)
+                path = os.path.join(self.asset_dir(key), '{t:017.6f}.ticks'.format(t=records['t'][written]))
+                paths.append(path)
+                self.roll_over(paths, records['t'][-1])
+                size = 0
+            chunk = records[written:written + self.segment_records - size]
+            with open(path, 'ab') as f:
+                chunk.tofile(f)
+            self.maps.pop(path, None)
+            written += len(chunk)
+        ring.unflushed = 0
+
+    # Deletes the segments before the last one to start at or before the retention cutoff, whose ticks are all
+    # older than the cutoff, and drops the cached maps of the segments that are left.
+    def roll_over(self, paths, newest):
+        if self.retention:
+            expired = 0
+            while expired < len(paths) - 1 and segment_start(paths[expired + 1]) <= newest - self.retention:
+                expired += 1
+            for path in paths[:expired]:
+                self.maps.pop(path, None)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            del paths[:expired]
+        for path in paths[:-1]:
+            self.maps.pop(path, None)
+
+    def flush_all(self):
+        for key in list(self.rings):
+            self.flush(key)
+
+    # Maps only whole records, so a segment being appended to by a flush reads as its ticks so far. A segment
+    # deleted by a flush since the caller listed it reads as empty.
+    def segment(self, path):
+        records = self.maps.get(path)
+        if records is None:
+            try:
+                count = os.path.getsize(path) // TICK.itemsize
+                if count == 0:
+                    return np.empty(0, dtype=TICK)
+                records = self.maps[path] = np.memmap(path, dtype=TICK, mode='r', shape=(count,))
+            except FileNotFoundError:
+                return np.empty(0, dtype=TICK)
+        return records
+
+    # (times, prices) of the ticks with start <= t < end. Ticks still in memory are served from the ring, older
+    # ones from the segments, whose first tick time is in their file name.
+    def range(self, key, start, end):
+        ring = self.rings.get(key)
+        ring_times, ring_prices = ring.ordered() if ring is not None else (np.empty(0), np.empty(0))
+        disk_end = min(end, ring_times[0]) if len(ring_times) else end
+        parts = []
+        paths = list(self.segment_paths(key))
+        for i, path in enumerate(paths):
+            first = segment_start(path)
+            following = segment_start(paths[i + 1]) if i + 1 < len(paths) else None
+            if first >= disk_end or (following is not None and following <= start):
+                continue
+            records = self.segment(path)
+            lo, hi = np.searchsorted(records['t'], [start, disk_end])
+            if hi > lo:
+                parts.append((records['t'][lo:hi], records['p'][lo:hi]))
+        lo, hi = np.searchsorted(ring_times, [start, end])
+        parts.append((ring_times[lo:hi], ring_prices[lo:hi]))
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    # Open, high, low and close per bucket of `bucket` seconds, for the buckets that saw any ticks.
+    def ohlc(self, key, start, end, bucket):
+        times, prices = self.range(key, start, end)
+        if len(times) == 0:
+            return []
+        buckets = ((times - start) // bucket).astype(np.int64)
+        firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        lasts = np.r_[firsts[1:] - 1, len(times) - 1]
+        highs = np.maximum.reduceat(prices, firsts)
+        lows = np.minimum.reduceat(prices, firsts)
+        return [(start + buckets[f] * bucket, prices[f], high, low, prices[l])
+                for f, l, high, low in zip(firsts, lasts, highs, lows)]
+
+    # The last price seen at or before t, or None.
+    def price_at(self, key, t, lookback=7 * 86400):
+        times, prices = self.range(key, t - lookback, t + 1e-6)
+        return float(prices[-1]) if len(prices) else None
+
+    # Prices seen in the last max_age seconds, for the keys that have one.
+    def latest(self, keys, max_age):
+        oldest = time.time() - max_age
+        prices = {}
+        for key in keys:
+            ring = self.rings.get(key)
+            if ring is not None and ring.count and ring.last_time() >= oldest:
+                prices[key] = float(ring.prices[(ring.start + ring.count - 1) % ring.capacity])
+        return prices
+
+
+# Time of a segment's first tick, from its file name.
+def segment_start(path):
+    return float(os.path.basename(path)[:-len('.ticks')])
+
+
+history = TickStore()
+# Cleared in the worker process: the bot process owns the store and records the prices the worker publishes.
+recording = True
+
+
+def record(prices, t=None):
+    if recording and prices:
+        history.record_many(prices, t)
+
+
+# '30m', '4h', '1d' or '2w' in seconds, None if the period is not understood.
+def parse_period(period):
+    period = period.lower()
+    if len(period) < 2 or period[-1] not in PERIOD_UNITS or not period[:-1].isdigit() or int(period[:-1]) == 0:
+        return None
+    return int(period[:-1]) * PERIOD_UNITS[period[-1]]
@@ -0,0 +1,57 @@
+import bisect
+
+
+# Price triggers grouped by asset key. Each asset keeps its "fire below" and "fire above" thresholds in sorted
+# lists of (threshold, item_id), so the items crossed by a price are found with one bisect instead of a scan.
+class TriggerIndex:
+    def __init__(self):
+        self.below = {}
+        self.above = {}
+        self.items = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def keys(self):
+        return set(self.below) | set(self.above)
+
+    def clear(self):
+        self.below.clear()
+        self.above.clear()
+        self.items.clear()
+
+    def add(self, item_id, key, is_less_than, threshold):
+        if item_id in self.items:
+            self.remove(item_id)
+        side = self.below if is_less_than else self.above
+        bisect.insort(side.setdefault(key, []), (float(threshold), item_id))
+        self.items[item_id] = (key, is_less_than, float(threshold))
+
+    def remove(self, item_id):
+        entry = self.items.pop(item_id, None)
+        if entry is None:
+            return
+        key, is_less_than, threshold = entry
+        side = self.below if is_less_than else self.above
+        levels = side[key]
+        index = bisect.bisect_left(levels, (threshold, item_id))
+        if index < len(levels) and levels[index] == (threshold, item_id):
+            del levels[index]
+        if not levels:
+            del side[key]
+
+    def ids_for(self, key):
+        return [item_id for side in (self.below, self.above) for threshold, item_id in side.get(key, [])]
+
+    # Items whose condition holds at price, in the order a moving price would have crossed them: "below" items
+    # (fire once the price drops under their threshold) highest threshold first, "above" items lowest first.
+    def triggered(self, key, price):
+        below = self.below.get(key, [])
+        above = self.above.get(key, [])
+        below_start = bisect.bisect_right(below, (price, float('inf')))
+        above_end = bisect.bisect_left(above, (price, float('-inf')))
+        return [item_id for threshold, item_id in reversed(below[below_start:])] + \
+               [item_id for threshold, item_id in above[:above_end]]
@@ -0,0 +1,86 @@
+import numpy as np
+
+from util import helpers
+
+
+# Lays positions (get_positions output: discord_id -> asset dicts) out as column arrays with one row per holding.
+# asset_index points into keys, the distinct price_keys held; user_index points into users.
+def to_columns(positions):
+    users = list(positions)
+    keys = []
+    key_index = {}
+    user_index = []
+    asset_index = []
+    volume = []
+    avg_price = []
+    for u, discord_id in enumerate(users):
+        for asset in positions[discord_id]:
+            key = helpers.price_key(asset['name'], asset['is_crypto'])
+            i = key_index.get(key)
+            if i is None:
+                i = key_index[key] = len(keys)
+                keys.append(key)
+            user_index.append(u)
+            asset_index.append(i)
+            volume.append(asset['shares'])
+            avg_price.append(asset['avg_price'])
+    return {'users': users,
+            'keys': keys,
+            'user_index': np.array(user_index, dtype=np.intp),
+            'asset_index': np.array(asset_index, dtype=np.intp),
+            'volume': np.array(volume, dtype=np.float64),
+            'avg_price': np.array(avg_price, dtype=np.float64)}
+
+
+def price_vector(keys, prices, fallback_prices=None):
+    fallback_prices = fallback_prices or {}
+    vector = np.full(len(keys), np.nan)
+    for i, key in enumerate(keys):
+        if key[0] == 'USDOLLAR':
+            vector[i] = 1.0
+        else:
+            vector[i] = prices.get(key, fallback_prices.get(key, np.nan))
+    return vector
+
+
+# Values every position against one price vector. Assets with no price in prices or fallback_prices are valued
+# at their average cost and flagged as unpriced. Adds per-row price, value, unrealized P&L and percent change,
+# and per-user totals.
+def value_positions(positions, prices, fallback_prices=None):
+    valuation = to_columns(positions)
+    avg_price = valuation['avg_price']
+    volume = valuation['volume']
+
+    unit_price = price_vector(valuation['keys'], prices, fallback_prices)[valuation['asset_index']]
+    priced = ~np.isnan(unit_price)
+    unit_price = np.where(priced, unit_price, avg_price)
+    value = volume * unit_price
+    pnl = value - volume * avg_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change = np.where(avg_price != 0, (unit_price - avg_price) / avg_price * 100, 0.0)
+
+    valuation['priced'] = priced
+    valuation['price'] = unit_price
+    valuation['value'] = value
+    valuation['pnl'] = pnl
+    valuation['pct_change'] = pct_change
+    valuation['totals'] = np.bincount(valuation['user_index'], weights=value, minlength=len(valuation['users']))
+    return valuation
+
+
+def user_totals(valuation):
+    return dict(zip(valuation['users'], valuation['totals'].tolist()))
+
+
+# Copies the per-row results back onto the asset dicts the positions came from, for the formatters.
+def annotate(positions, valuation):
+    row = 0
+    for discord_id in valuation['users']:
+        for asset in positions[discord_id]:
+            asset['is_priced'] = bool(valuation['priced'][row])
+            asset['current_unit_price'] = float(valuation['price'][row])
+            asset['current_value'] = float(valuation['value'][row])
+            asset['unrealized_pl'] = float(valuation['pnl'][row])
+            asset['pcnt_change'] = float(valuation['pct_change'][row])
+            row += 1
+    return positions
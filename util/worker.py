@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+
+from util import alerts, database_connector, engines, helpers, notifier, order_book, price_board, \
+    price_feed as price_feeds, tick_history
+
+# 'process' runs the alert and limit order engines in a separate worker process; empty keeps them in the bot.
+WORKER_MODE = os.getenv('WORKER_MODE', '')
+WORKER_INTERVAL = float(os.getenv('WORKER_INTERVAL', '10'))
+PRICE_BOARD_SIZE = int(os.getenv('PRICE_BOARD_SIZE', '4096'))
+
+
+# The bot's side of the worker: starts the process, forwards alert and order changes to it, and collects the
+# notifications and trades it reports back. Commands read prices from the shared board.
+class WorkerHandle:
+    def __init__(self, stream=''):
+        context = multiprocessing.get_context('spawn')
+        self.board = price_board.PriceBoard.create(PRICE_BOARD_SIZE)
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(target=main, args=(self.board.name, self.commands, self.events, stream),
+                                       name='stock-bot-worker', daemon=True)
+
+    def start(self):
+        self.process.start()
+        alerts.remote = self.send
+        order_book.remote = self.send
+        helpers.price_board = self.board
+
+    def send(self, *message):
+        self.commands.put(message)
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stop(self):
+        self.send('stop')
+        self.process.join(WORKER_INTERVAL * 2)
+        if self.process.is_alive():
+            self.process.terminate()
+        alerts.remote = None
+        order_book.remote = None
+        helpers.price_board = None
+        self.board.close()
+        self.board.unlink()
+
+
+'''WORKER PROCESS'''
+
+
+def main(board_name, commands, events, stream=''):
+    try:
+        asyncio.run(run(board_name, commands, events, stream))
+    except KeyboardInterrupt:
+        pass
+
+
+# Applies the changes the bot sent since the last pass. Returns False once the bot asked the worker to stop.
+def apply_commands(commands, state):
+    while True:
+        try:
+            message = commands.get_nowait()
+        except queue.Empty:
+            return True
+        name, args = message[0], message[1:]
+        if name == 'stop':
+            return False
+        elif name == 'add_alert':
+            alerts.add_alert(*args)
+        elif name == 'remove_alert':
+            alerts.remove_alert(*args)
+        elif name == 'add_order':
+            order_book.add_order(*args)
+        elif name == 'remove_order':
+            order_book.remove_order(*args)
+        elif name == 'channels':
+            state['channels'] = set(args[0])
+        elif name == 'names':
+            state['names'].update(args[0])
+
+
+def send_outbox(outbox, events):
+    for channel_id, texts in outbox.messages.items():
+        for text in texts:
+            events.put(('message', channel_id, text))
+
+
+async def run(board_name, commands, events, stream=''):
+    board = price_board.PriceBoard.attach(board_name)
+    tick_history.recording = False
+    database_connector.trade_listeners.append(lambda discord_id: events.put(('trade', str(discord_id))))
+    state = {'channels': None, 'names': {}}
+
+    def is_visible(channel_id):
+        return state['channels'] is None or channel_id in state['channels']
+
+    def member_name(discord_id):
+        return state['names'].get(str(discord_id))
+
+    async def run_passes(prices, failed=(), keys=None):
+        outbox = notifier.Outbox()
+        await engines.alert_pass(prices, outbox, failed, keys, is_visible)
+        await engines.order_pass(prices, outbox, failed, keys, is_visible, member_name)
+        send_outbox(outbox, events)
+
+    async def on_stream_prices(prices):
+        board.publish(prices)
+        async with database_connector.scope():
+            await run_passes(prices, keys=prices.keys())
+
+    feed = price_feeds.create_feed(stream)
+    if feed is not None:
+        feed.subscribe(on_stream_prices)
+        feed.start()
+
+    logging.info('Worker started, publishing prices to ' + board_name)
+    try:
+        while apply_commands(commands, state):
+            try:
+                async with database_connector.scope():
+                    await alerts.ensure_loaded()
+                    await order_book.ensure_loaded()
+                    held = await database_connector.run(database_connector.get_held_assets)
+                    keys = {key for key in alerts.price_keys() | order_book.price_keys() |
+                            {helpers.price_key(code, is_crypto) for code, is_crypto in held}
+                            if feed is None or not feed.covers(key)}
+                    failed = set()
+                    prices = await helpers.get_prices(keys, failed=failed)
+                    board.publish(prices)
+                    await run_passes(prices, failed, keys)
+            except Exception as e:
+                logging.error('Error in worker pass: ' + repr(e))
+            await asyncio.sleep(WORKER_INTERVAL)
+    finally:
+        if feed is not None:
+            await feed.stop()
+        board.close()